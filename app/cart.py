@@ -0,0 +1,54 @@
+"""
+Filename: cart.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Keeps the family_cart projection used by /family/checkout in step with student_class.
+             Call refresh_cart in the same transaction as any change to a family's unpaid classes.
+"""
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import FamilyCart, StudentClass, Student, Classes
+
+CART_COLUMNS = ['sc_id', 'family_id', 'year', 'student_id', 'class_id', 'wait', 'paid', 'paid_price', 'created',
+                'removed', 'first_name', 'last_name', 'chinese_name', 'dob', 'title', 'chinese_title']
+
+
+def cart_source(year: int, family_id: int = None):
+    query = (
+        select(
+            StudentClass.sc_id, Student.family_id, StudentClass.year, StudentClass.student_id, StudentClass.class_id,
+            StudentClass.wait, StudentClass.paid, StudentClass.paid_price, StudentClass.created, StudentClass.removed,
+            Student.first_name, Student.last_name, Student.chinese_name, Student.dob,
+            Classes.title, Classes.chinese_title,
+        )
+        .join(Student, Student.student_id == StudentClass.student_id)
+        .join(Classes, Classes.class_id == StudentClass.class_id)
+        .filter(StudentClass.paid == 0)
+        .filter(StudentClass.wait == 0)
+        .filter(StudentClass.year == year)
+    )
+    if family_id is not None:
+        query = query.filter(Student.family_id == family_id)
+    return query
+
+
+def refresh_cart_statements(year: int, family_id: int = None):
+    """Statements replacing the cart of one family, or of every family when family_id is None."""
+    clear = delete(FamilyCart)
+    if family_id is not None:
+        clear = clear.where(FamilyCart.family_id == family_id)
+    fill = insert(FamilyCart).from_select(CART_COLUMNS, cart_source(year, family_id))
+    return clear, fill
+
+
+async def refresh_cart(db: AsyncSession, family_id: int, year: int):
+    for statement in refresh_cart_statements(year, family_id):
+        await db.execute(statement)
+
+
+def rebuild_carts(bind, year: int):
+    with bind.begin() as connection:
+        for statement in refresh_cart_statements(year):
+            connection.execute(statement)
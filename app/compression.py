@@ -0,0 +1,113 @@
+"""
+Filename: compression.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Response compression middleware. Picks brotli or gzip from Accept-Encoding (q-values honored, brotli
+             only when the optional brotli package is installed) and leaves bodies under COMPRESS_MIN_SIZE bytes
+             alone. Streamed responses (admin dumps, rosters) are compressed chunk by chunk. A compressed response's
+             ETag gets the coding as suffix, the compressed bytes are not the identity bytes the tag was made for.
+"""
+
+import os
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from .etags import coded_etag, header_etags
+
+try:
+    import brotli
+except ImportError:         # optional, gzip only without it
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: str, supported = None):
+    """Encoding with the highest q-value among supported (in preference order), None for identity."""
+    supported = supported_encodings() if supported is None else supported
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = 'br'
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality = self.quality)
+        data = self._compressor.process(body)
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE, gzip_level: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope = scope)
+        encoding = choose_encoding(request_headers.get('accept-encoding', ''))
+        if encoding == 'br':
+            responder = BrotliResponder(self.app, self.minimum_size, quality = self.brotli_quality)
+        elif encoding == 'gzip':
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel = self.gzip_level)
+        else:
+            await IdentityResponder(self.app, self.minimum_size)(scope, receive, send)
+            return
+
+        async def send_with_etag(message):
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(raw = message['headers'])
+                etag = headers.get('etag')
+                if etag is not None and self.sends_coded(message['status'], headers, responder, encoding, etag,
+                                                         request_headers):
+                    headers['ETag'] = coded_etag(etag, encoding)
+            await send(message)
+
+        await responder(scope, receive, send_with_etag)
+
+    @staticmethod
+    def sends_coded(status: int, headers, responder, encoding: str, etag: str, request_headers):
+        if status == 304:
+            # no body to compress, echo the tag the client revalidated when it held the compressed representation
+            return coded_etag(etag, encoding) in header_etags(request_headers.get('if-none-match', ''), uncoded = False)
+        # compressed here, not by the app itself
+        return headers.get('content-encoding') == encoding and not responder.content_encoding_set
@@ -7,17 +7,113 @@ Description: Establishes connection to database
 """
 
 import os
+import threading
+import time
+from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+load_dotenv()
+
+
+class TimedPoolMixin:
+    """Records how long requests wait to check out a connection from the pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def recreate(self):
+        # keep the counters when the pool is rebuilt after a disconnect
+        new_pool = super().recreate()
+        new_pool.checkouts, new_pool.wait_total, new_pool.wait_max = self.checkouts, self.wait_total, self.wait_max
+        return new_pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# async drivers used for the same database by the async engine
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def to_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+# Pool settings, tune through the environment (.env). POOL_RECYCLE should stay below MySQL's wait_timeout
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+pool_options = {
+    'pool_size': POOL_SIZE,
+    'max_overflow': MAX_OVERFLOW,
+    'pool_timeout': POOL_TIMEOUT,
+    'pool_recycle': POOL_RECYCLE,
+    'pool_pre_ping': POOL_PRE_PING,
+}
 
 if os.environ.get('TESTING') == '1':
-    DATABASE_URL = 'sqlite:///./test.db' 
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    DATABASE_URL = 'sqlite:///./test.db'
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False},
+                           poolclass = TimedQueuePool, **pool_options)
 else:
-    DATABASE_URL = 'connect database here' 
-    engine = create_engine(DATABASE_URL)
+    DATABASE_URL = os.environ.get('DATABASE_URL', 'connect database here')
+    engine = create_engine(DATABASE_URL, poolclass = TimedQueuePool, **pool_options)
+
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL') or to_async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass = TimedAsyncQueuePool, **pool_options)
 
 SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_ = AsyncSession, autoflush = False,
+                                       expire_on_commit = False)
 
 Base = declarative_base()
+
+
+def pool_stats(pool = None):
+    pool = pool or engine.pool
+    checkouts = getattr(pool, 'checkouts', 0)
+    wait_total = getattr(pool, 'wait_total', 0.0)
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': checkouts,
+        'wait_seconds_total': round(wait_total, 6),
+        'wait_seconds_avg': round(wait_total / checkouts, 6) if checkouts else 0.0,
+        'wait_seconds_max': round(getattr(pool, 'wait_max', 0.0), 6),
+    }
@@ -0,0 +1,83 @@
+"""
+Filename: discovery.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: On-disk cache of OAuth provider discovery documents (server_metadata_url) and their JWKS, shared by
+             every worker on the host. Entries are JSON files named by the sha256 of the url and replaced atomically,
+             so workers never read a half written file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# seconds a cached document is served before it is fetched again
+METADATA_TTL = int(os.environ.get('OAUTH_METADATA_TTL', 24 * 3600))
+CACHE_DIR = os.environ.get('OAUTH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'oauth_metadata'))
+FETCH_TIMEOUT = 10
+
+
+def cache_path(url: str, cache_dir: str = None):
+    return os.path.join(cache_dir or CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+
+def read_entry(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_entry(path: str, entry: dict):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+
+async def fetch_json(url: str, ttl: int = None, cache_dir: str = None):
+    """
+    Returns (document, fetched_at). A fresh entry is read from disk, otherwise the url is fetched and stored.
+    If the provider cannot be reached a stale entry is still served.
+    """
+    import httpx
+
+    ttl = METADATA_TTL if ttl is None else ttl
+    path = cache_path(url, cache_dir)
+    entry = read_entry(path)
+    if entry is not None and entry['fetched'] + ttl > time.time():
+        return entry['document'], entry['fetched']
+
+    try:
+        async with httpx.AsyncClient(timeout = FETCH_TIMEOUT) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+            document = response.json()
+    except (httpx.HTTPError, ValueError):
+        if entry is None:
+            raise
+        return entry['document'], entry['fetched']
+
+    entry = {'url': url, 'fetched': time.time(), 'document': document}
+    write_entry(path, entry)
+    return document, entry['fetched']
+
+
+async def load_server_metadata(url: str, ttl: int = None, cache_dir: str = None):
+    """
+    Discovery document with the key set under 'jwks' and '_loaded_at' set, the shape authlib keeps in
+    client.server_metadata. A client updated with it fetches neither document itself.
+    """
+    document, fetched = await fetch_json(url, ttl, cache_dir)
+    metadata = dict(document)
+    if 'jwks_uri' in metadata:
+        metadata['jwks'], jwks_fetched = await fetch_json(metadata['jwks_uri'], ttl, cache_dir)
+        fetched = min(fetched, jwks_fetched)
+    metadata['_loaded_at'] = fetched
+    return metadata
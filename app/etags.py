@@ -0,0 +1,132 @@
+"""
+Filename: etags.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: ETags for conditional requests. A row's ETag is its key and modified timestamp, so GETs can answer
+             304 from the family context and an If-Match edit becomes an UPDATE ... WHERE modified = <timestamp>
+             instead of a locked read. Read-mostly GETs are revalidated against a cheap version key and answer 304
+             before running their query.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import select, update
+
+MODIFIED_FORMAT = "%Y%m%d%H%M%S%f"
+
+# Stored by the browser or a reverse proxy and revalidated on every use, Vary keeps one copy per bearer token
+CACHE_CONTROL = "max-age=0, must-revalidate"
+
+# CompressionMiddleware tags a compressed representation "<etag>-<coding>", conditional requests compare the tag
+# without the suffix since every coding holds the same data
+CONTENT_CODINGS = ('gzip', 'br')
+
+
+def modified_now():
+    # the legacy DATETIME columns keep whole seconds, the ETag sent back must match what is stored
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def next_modified(previous: datetime):
+    # always after the stored stamp, two edits within the same second must not share an ETag
+    return max(modified_now(), previous + timedelta(seconds=1))
+
+
+async def versioned_update(db, key_column, key, values: dict, expected: datetime = None, current: datetime = None):
+    """
+    UPDATE of the row key_column == key setting values and modified = next_modified(stored stamp), guarded by
+    WHERE modified = <stored stamp>. With If-Match the stamp is expected and a changed row fails with 412, otherwise
+    it is current (or read) and the UPDATE is retried on the new stamp when another edit got in first. Returns the
+    new stamp, 404 when the row is gone. The caller commits.
+    """
+    model = key_column.class_
+    previous = expected if expected is not None else current
+    while True:
+        if previous is None:
+            previous = (await db.execute(select(model.modified).where(key_column == key))).scalar()
+            if previous is None:
+                raise HTTPException(status_code=404, detail="Not Found")
+        stamp = next_modified(previous)
+        statement = (
+            update(model)
+            .where(key_column == key, model.modified == previous)
+            .values(**values, modified = stamp)
+            .execution_options(synchronize_session = False)
+        )
+        if (await db.execute(statement)).rowcount:
+            return stamp
+        if expected is not None:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Profile was changed, reload it")
+        previous = None
+
+
+def row_etag(key, modified: datetime):
+    return f'"{key}-{modified.strftime(MODIFIED_FORMAT)}"'
+
+
+def list_etag(key, rows):
+    """ETag of a list of (row key, modified) pairs, in response order."""
+    digest = hashlib.sha1(repr([(row_key, modified.strftime(MODIFIED_FORMAT)) for row_key, modified in rows]).encode())
+    return f'"{key}-{digest.hexdigest()}"'
+
+
+def coded_etag(etag: str, coding: str):
+    return f'{etag[:-1]}-{coding}"'
+
+
+def uncoded_etag(tag: str):
+    for coding in CONTENT_CODINGS:
+        suffix = f'-{coding}"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def header_etags(value: str, uncoded: bool = True):
+    # weak comparison, W/ is ignored and so is the content coding suffix
+    tags = [tag.strip().removeprefix('W/') for tag in value.split(',') if tag.strip()]
+    return [uncoded_etag(tag) for tag in tags] if uncoded else tags
+
+
+def not_modified(request: Request, etag: str):
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return False
+    tags = header_etags(header)
+    return '*' in tags or etag in tags
+
+
+def revalidate(request: Request, response: Response, *version):
+    """
+    Sets a strong ETag of the path and version key plus Cache-Control on response, raises 304 when the
+    client already holds that version so the route never runs its query.
+    """
+    etag = '"' + hashlib.sha1(repr((request.url.path,) + version).encode()).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Authorization'}
+    if not_modified(request, etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+
+def if_match_modified(request: Request, key):
+    """
+    modified timestamp the If-Match header expects for the row key, None when the edit is unconditional
+    (no header or *). Any other ETag can never match and fails with 412.
+    """
+    header = request.headers.get('if-match')
+    if header is None:
+        return None
+    tags = header_etags(header)
+    if '*' in tags:
+        return None
+
+    prefix = f'"{key}-'
+    for tag in tags:
+        if tag.startswith(prefix) and tag.endswith('"'):
+            try:
+                return datetime.strptime(tag[len(prefix):-1], MODIFIED_FORMAT)
+            except ValueError:
+                pass
+    raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Profile was changed, reload it")
@@ -0,0 +1,56 @@
+"""
+Filename: history.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Payment history. Paid orders from past years are summarized once into order_summary,
+             /family/payments reads those rows and only aggregates the orders not summarized yet.
+             Run from the project root after a term closes: python -m app.history
+"""
+
+from datetime import datetime
+from sqlalchemy import select, insert, func, union_all
+from .database import engine
+from .models import Order, OrderStudentClass, OrderSummary
+from .serializers import model_columns
+
+SUMMARY_COLUMNS = ['order_id', 'year', 'family_id', 'created', 'paid', 'canceled', 'amount', 'payment_method',
+                   'transaction_id', 'number_of_classes']
+
+
+def live_orders(family_id: int = None):
+    query = (
+        select(*model_columns(Order), func.count(OrderStudentClass.osc_id).label("number_of_classes"))
+        .outerjoin(OrderStudentClass, Order.order_id == OrderStudentClass.order_id)
+        .group_by(Order.order_id)
+    )
+    if family_id is not None:
+        query = query.filter(Order.family_id == family_id)
+    return query
+
+
+def payment_history(family_id: int):
+    """Summarized orders plus the family's orders that are not summarized yet, in one statement."""
+    summarized = select(*(getattr(OrderSummary, name) for name in SUMMARY_COLUMNS)).filter(OrderSummary.family_id == family_id)
+    live = (
+        live_orders(family_id)
+        .filter(Order.paid.isnot(False))
+        .filter(Order.order_id.not_in(select(OrderSummary.order_id).filter(OrderSummary.family_id == family_id)))
+    )
+    return union_all(summarized, live).order_by(summarized.selected_columns.paid)
+
+
+def summarize_past_orders(bind, before_year: int):
+    """Adds paid orders older than before_year that are not in order_summary yet. Returns the number added."""
+    pending = (
+        live_orders()
+        .filter(Order.year < before_year)
+        .filter(Order.paid.isnot(None))
+        .filter(Order.order_id.not_in(select(OrderSummary.order_id)))
+    )
+    with bind.begin() as connection:
+        return connection.execute(insert(OrderSummary).from_select(SUMMARY_COLUMNS, pending)).rowcount
+
+
+if __name__ == "__main__":
+    print("summarized", summarize_past_orders(engine, datetime.now().year), "orders")
@@ -7,9 +7,12 @@ Description: Main entry point, registers routers
 """
 
 
+import os
 from fastapi import FastAPI
 from .models import *
-from .database import engine
+from .database import engine, async_engine, pool_stats
+from .metrics import metrics, metrics_middleware, instrument_engine
+from .compression import CompressionMiddleware
 from .routers import auth, family, student, register, admin, payments
 
 from starlette.middleware.sessions import SessionMiddleware
@@ -18,9 +21,17 @@ from .routers.auth import SECRET_KEY
 
 app = FastAPI()
 app.add_middleware(SessionMiddleware, secret_key = SECRET_KEY, https_only = False)
+app.add_middleware(CompressionMiddleware)         # COMPRESS_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY from env
+app.middleware("http")(metrics_middleware)
 
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
-Base.metadata.create_all(bind = engine)
+
+# Schema changes are applied with `python -m app.migrate`. CREATE_SCHEMA=1 creates missing tables at startup
+# (local development), every worker restart would otherwise pay the reflection round trips
+if os.environ.get('CREATE_SCHEMA') == '1':
+    Base.metadata.create_all(bind = engine)
 
 
 
@@ -29,6 +40,18 @@ def health_check():
     return {'status': 'Healthy'}
 
 
+@app.get("/healthy/pool")
+def database_pool_stats():
+    stats = pool_stats()
+    stats['async'] = pool_stats(async_engine.sync_engine.pool)
+    return stats
+
+
+@app.get("/metrics")
+def request_metrics():
+    return {'routes': metrics.snapshot(), 'pool': database_pool_stats()}
+
+
 app.include_router(auth.router)
 app.include_router(family.router)
 app.include_router(student.router)
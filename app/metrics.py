@@ -0,0 +1,110 @@
+"""
+Filename: metrics.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Per-route latency histograms, database query counts and database time per request
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.requests import Request
+
+# upper bounds in seconds, the last bucket counts everything slower
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# stats of the request being handled: {'queries': int, 'db_time': float}
+current_request = ContextVar('current_request', default = None)
+
+
+class RouteStats:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.queries_total = 0
+        self.db_time_total = 0.0
+
+    def observe(self, latency: float, queries: int, db_time: float, error: bool):
+        self.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.errors += error
+        self.latency_total += latency
+        self.queries_total += queries
+        self.db_time_total += db_time
+
+    def as_dict(self):
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency_seconds_avg': round(self.latency_total / count, 6),
+            'latency_buckets': {**{str(le): n for le, n in zip(LATENCY_BUCKETS, self.buckets)}, '+Inf': self.buckets[-1]},
+            'db_queries_avg': round(self.queries_total / count, 3),
+            'db_queries_total': self.queries_total,
+            'db_seconds_avg': round(self.db_time_total / count, 6),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def observe(self, route: str, latency: float, queries: int, db_time: float, error: bool):
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.observe(latency, queries, db_time, error)
+
+    def snapshot(self):
+        with self._lock:
+            return {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start'].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats['queries'] += 1
+        stats['db_time'] += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Counts queries and database time for the current request on engine (pass async_engine.sync_engine for async)."""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+async def metrics_middleware(request: Request, call_next):
+    stats = {'queries': 0, 'db_time': 0.0}
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    error = True
+    try:
+        response = await call_next(request)
+        error = response.status_code >= 500
+        return response
+    finally:
+        latency = time.perf_counter() - start
+        current_request.reset(token)
+        route = request.scope.get('route')
+        name = f"{request.method} {route.path}" if route is not None else f"{request.method} unmatched"
+        metrics.observe(name, latency, stats['queries'], stats['db_time'], error)
@@ -0,0 +1,79 @@
+"""
+Filename: migrate.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Brings the existing legacy tables up to the models. create_all only creates missing tables,
+             so indexes declared on models for tables that already exist are added here, and derived tables
+             (family_cart) are rebuilt. An index that became unique replaces the plain one of the same name, duplicate
+             userinfo emails are removed first (the oldest row is kept, with profile_created set if any duplicate had it).
+             Run from the project root: python -m app.migrate
+"""
+
+from datetime import datetime
+from sqlalchemy import inspect, select, update, delete, func
+from .database import Base, engine
+from .models import *
+from .cart import rebuild_carts
+
+
+def missing_indexes(bind):
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        # (columns, unique), a plain index is also covered by a unique one
+        existing = {(tuple(ix['column_names']), bool(ix['unique'])) for ix in inspector.get_indexes(table.name)}
+        existing |= {(tuple(uq['column_names']), True) for uq in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            columns = tuple(c.name for c in index.columns)
+            if (columns, True) not in existing and (index.unique or (columns, False) not in existing):
+                missing.append(index)
+    return missing
+
+
+def remove_duplicate_user_info(bind):
+    """Keeps the oldest userinfo row of each email, with MAX(profile_created) of its duplicates. Returns rows deleted."""
+    # derived tables, MySQL does not allow the changed table in a plain subquery
+    keep = select(func.min(UserInfo.id).label('id')).group_by(UserInfo.email).subquery('keep')
+    created = select(UserInfo.email).where(UserInfo.profile_created == True).distinct().subquery('created')
+    with bind.begin() as connection:
+        connection.execute(
+            update(UserInfo)
+            .where(UserInfo.id.in_(select(keep.c.id)))
+            .where(UserInfo.email.in_(select(created.c.email)))
+            .values(profile_created = True)
+        )
+        return connection.execute(delete(UserInfo).where(UserInfo.id.not_in(select(keep.c.id)))).rowcount
+
+
+def create_missing_indexes(bind):
+    """Returns the names of the indexes created and the number of duplicate userinfo rows deleted."""
+    created = []
+    removed = 0
+    inspector = inspect(bind)
+    for index in missing_indexes(bind):
+        if index.table.name == UserInfo.__tablename__ and index.unique:
+            removed += remove_duplicate_user_info(bind)
+        if index.name in {ix['name'] for ix in inspector.get_indexes(index.table.name)}:
+            index.drop(bind)
+        index.create(bind)
+        created.append(index.name)
+    return created, removed
+
+
+def migrate(bind = engine):
+    Base.metadata.create_all(bind = bind)
+    created, removed = create_missing_indexes(bind)
+    rebuild_carts(bind, datetime.now().year)       # family_cart is derived from student_class, rebuild it from scratch
+    return created, removed
+
+
+if __name__ == "__main__":
+    created, removed = migrate()
+    if removed:
+        print("removed duplicate userinfo rows", removed)
+    for name in created:
+        print("created index", name)
@@ -3,22 +3,134 @@ Filename: admin.py
 Author: Meghan Dang
 Date: 2025-01-16
 Version: 1.0
-Description: Endpoints for reading all families and students, will not be needed in actual app
+Description: Endpoints for reading all families and students (will not be needed in actual app), class roster exports and enrollment counts
 """
 
-from fastapi import APIRouter
-from ..models import Student, Family
-from .auth import db_dependency
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, case
+from ..models import Student, Family, StudentClass, Classes
+from .auth import db_dependency, get_admin_family
 
+# every endpoint returns family and student personal data, signed in admins only (ADMIN_EMAILS)
 router = APIRouter(
     prefix = '/admin',
-    tags = ['admin']
+    tags = ['admin'],
+    dependencies = [Depends(get_admin_family)]
 )
 
+STREAM_BATCH_SIZE = 500
+
+
+# Keyset pagination: pass the last id of the previous page as after_id.
+# With stream=true every row after after_id is sent as NDJSON, loaded STREAM_BATCH_SIZE rows at a time
+def read_table(db, model, key, after_id: int, limit: int, stream: bool):
+    query = db.query(model).filter(key > after_id).order_by(key)
+
+    if not stream:
+        return query.limit(limit).all()
+
+    columns = [c.name for c in model.__table__.columns]
+
+    def rows():
+        for obj in query.yield_per(STREAM_BATCH_SIZE):
+            item = {name: getattr(obj, name) for name in columns}
+            db.expunge(obj)     # keep the identity map from growing with the table
+            yield json.dumps(jsonable_encoder(item)) + "\n"
+
+    return StreamingResponse(rows(), media_type = "application/x-ndjson")
+
+
 @router.get("/read_families")
-async def read_all_families(db: db_dependency):
-    return db.query(Family).all()
+def read_all_families(db: db_dependency, after_id: int = 0, limit: int = Query(100, gt = 0, le = 1000),
+                      stream: bool = False):
+    return read_table(db, Family, Family.family_id, after_id, limit, stream)
 
 @router.get("/read_students")
-async def read_all_students(db: db_dependency):
-    return db.query(Student).all()
+def read_all_students(db: db_dependency, after_id: int = 0, limit: int = Query(100, gt = 0, le = 1000),
+                      stream: bool = False):
+    return read_table(db, Student, Student.student_id, after_id, limit, stream)
+
+
+ROSTER_COLUMNS = [
+    StudentClass.year, Classes.class_id, Classes.class_code, Classes.title, Classes.chinese_title,
+    Student.student_id, Student.first_name, Student.last_name, Student.chinese_name, Student.gender, Student.grade,
+    Student.dob, StudentClass.wait, StudentClass.paid, Family.family_id, Family.father_fname, Family.father_lname,
+    Family.mother_fname, Family.mother_lname, Family.phone, Family.email,
+]
+
+
+# Class rosters as CSV, streamed STREAM_BATCH_SIZE rows at a time so memory does not grow with the roster
+@router.get("/rosters.csv")
+def export_rosters(db: db_dependency, year: Optional[int] = None, class_id: Optional[int] = None):
+    year = year or datetime.now().year
+    query = (
+        db.query(*ROSTER_COLUMNS)
+        .select_from(StudentClass)
+        .join(Student, Student.student_id == StudentClass.student_id)
+        .join(Classes, Classes.class_id == StudentClass.class_id)
+        .join(Family, Family.family_id == Student.family_id)
+        .filter(StudentClass.year == year)
+        .order_by(StudentClass.class_id, StudentClass.wait, Student.last_name, Student.first_name)
+    )
+    if class_id is not None:
+        query = query.filter(StudentClass.class_id == class_id)
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([column.key for column in ROSTER_COLUMNS])
+        for i, row in enumerate(query.yield_per(STREAM_BATCH_SIZE), start = 1):
+            writer.writerow(row)
+            if i % STREAM_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    headers = {'Content-Disposition': f'attachment; filename="rosters_{year}.csv"'}
+    return StreamingResponse(rows(), media_type = "text/csv", headers = headers)
+
+
+# Enrollment per class for a year in one aggregate query. Plain def: the sync Session runs in the threadpool,
+# not on the event loop
+@router.get("/enrollment")
+def enrollment_counts(db: db_dependency, year: Optional[int] = None):
+    year = year or datetime.now().year
+    enrolled = func.sum(case((StudentClass.wait == 0, 1), else_ = 0))
+    counts = (
+        db.query(
+            StudentClass.class_id,
+            Classes.class_code,
+            Classes.title,
+            Classes.seats_x,
+            enrolled.label("enrolled"),
+            func.sum(case((StudentClass.wait != 0, 1), else_ = 0)).label("waitlisted"),
+            func.sum(case((StudentClass.paid != 0, 1), else_ = 0)).label("paid"),
+        )
+        .outerjoin(Classes, Classes.class_id == StudentClass.class_id)
+        .filter(StudentClass.year == year)
+        .group_by(StudentClass.class_id, Classes.class_code, Classes.title, Classes.seats_x)
+        .order_by(StudentClass.class_id)
+        .all()
+    )
+
+    return [
+        {
+            "class_id": row.class_id,
+            "class_code": row.class_code,
+            "title": row.title,
+            "seats": row.seats_x,
+            "enrolled": int(row.enrolled),
+            "waitlisted": int(row.waitlisted),
+            "paid": int(row.paid),
+            "seats_left": None if row.seats_x is None else max(row.seats_x - int(row.enrolled), 0),
+        }
+        for row in counts
+    ]
@@ -7,18 +7,25 @@ Description: Authentication, session, third-party OAuth (Google, Facebook, Yahoo
 """
 
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from sqlalchemy import and_, exists
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 from pydantic import BaseModel
 from jose import jwt, JWTError
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from starlette.requests import Request
-from authlib.integrations.starlette_client import OAuth, OAuthError
 import os 
+import hashlib
+import time
 from dotenv import load_dotenv
 from ..models import Family, UserInfo
-from ..database import SessionLocal 
+from ..database import SessionLocal, AsyncSessionLocal
+from ..cache import TTLCache
+from ..sessions import FamilyContext, family_contexts
+from ..discovery import load_server_metadata, METADATA_TTL
 
 
 router = APIRouter(
@@ -39,24 +46,88 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Verified tokens, keyed by their sha256, so repeat requests from a session skip jwt.decode.
+# Each entry expires with the token's own exp claim
+TOKEN_CACHE_SIZE = 4096
+token_cache = TTLCache(ttl = 0, maxsize = TOKEN_CACHE_SIZE)
+
+
+def decode_family_token(token: str):
+    key = hashlib.sha256(token.encode()).hexdigest()
+    cached = token_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
+    email : str = payload.get('sub')
+    family_id: int = payload.get('id')
+
+    if email is None or family_id is None:
+        raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
+                            detail = 'Could not validate credentials')
+
+    family = {'email': email, 'family_id': family_id}
+    expires = payload.get('exp')
+    if expires is not None:
+        token_cache.set(key, family, ttl = expires - datetime.now(timezone.utc).timestamp())
+    return dict(family)
+
+
 async def get_current_family(token: str = Depends(oauth2_bearer)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
-        email : str = payload.get('sub')
-        family_id: int = payload.get('id')
-
-        if email is None or family_id is None:
-            raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
-                                detail = 'Could not validate credentials')
-        return {'email': email, 'family_id': family_id}
+        return decode_family_token(token)
     except JWTError:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED)        
 
 
 db_dependency = Annotated[Session, Depends(get_db)]
+async_db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
 family_dependency = Annotated[dict, Depends(get_current_family)]
 
 
+# Family row and owned students of the signed in family, from the session store
+async def get_family_context(family: family_dependency, db: async_db_dependency):
+    context = await family_contexts.load(db, family.get('family_id'))
+    if context is None:
+        raise HTTPException(status_code=404, detail="Family not found")
+    return context
+
+
+family_context_dependency = Annotated[FamilyContext, Depends(get_family_context)]
+
+
+# Student named by the student_id path parameter, verified against the family context once per request. A student
+# missing from the context is looked up once before the request is rejected, it may have been added by another worker
+async def get_family_student(student_id: int, context: family_context_dependency, db: async_db_dependency):
+    student = context.student(student_id)
+    if student is None:
+        student = (await family_contexts.load_students(db, context.family_id, [student_id])).get(student_id)
+    if student is None:
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    return student
+
+
+student_dependency = Annotated[dict, Depends(get_family_student)]
+
+
+# Signed in families allowed to use the /admin endpoints, comma separated emails
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+
+async def get_admin_family(family: family_dependency):
+    if family.get('email', '').lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = 'Admin only')
+    return family
+
+
+admin_dependency = Annotated[dict, Depends(get_admin_family)]
+
+
 class CreateFamilyRequest(BaseModel):
     email: str
     password: str
@@ -83,98 +154,132 @@ def create_access_token(email: str, family_id: int, expires_delta: timedelta):
     encode.update({'exp': expires})
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-# google log in
+def login_statement(dialect: str, email: str, first_name: str, last_name: str, access_token: str):
+    """
+    Insert of the userinfo row for an OAuth login. When the email already has a row only profile_created is
+    updated, it is cleared if no family uses the email (the user is prompted to fill out the family profile).
+    """
+    values = dict(email = email, first_name = first_name, last_name = last_name, profile_created = False,
+                  token_ = access_token)
+    profile_created = and_(UserInfo.profile_created, exists().where(Family.email == email))
+    if dialect == 'mysql':
+        return mysql.insert(UserInfo).values(**values).on_duplicate_key_update(profile_created = profile_created)
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    return insert(UserInfo).values(**values).on_conflict_do_update(
+        index_elements = [UserInfo.email], set_ = {'profile_created': profile_created})
+
+
+# userinfo.token_ keeps a sha256 of the provider's access token: nothing reads the token back, and provider
+# tokens (Google's run past 200 characters) do not fit the legacy VARCHAR(100)
+def token_digest(access_token: str):
+    return hashlib.sha256((access_token or '').encode()).hexdigest()
+
+
+async def resolve_login(db: AsyncSession, email: str, first_name: str, last_name: str, token: dict):
+    """Creates or updates the userinfo row of an OAuth login in one statement, keyed on the unique userinfo.email."""
+    statement = login_statement(db.get_bind().dialect.name, email, first_name, last_name,
+                                token_digest(token.get('access_token')))
+    await db.execute(statement)
+    await db.commit()
+
+
+# OAuth clients are registered on first use, importing authlib and building the clients stays off startup.
+# OAUTH_PROVIDERS holds the registration arguments of each provider. Discovery documents and JWKS come from the
+# shared on-disk cache in discovery.py instead of being fetched by authlib in every worker
 
 load_dotenv()
-CLIENT_ID = os.environ.get('google-id', None)
-CLIENT_SECRET = os.environ.get('google-secret', None)
+OAUTH_PROVIDERS = {}
+_oauth = None
+
+
+async def get_oauth_client(name: str):
+    global _oauth
+    config = OAUTH_PROVIDERS[name]
+    if not config.get('client_id') or not config.get('client_secret'):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"{name} login is not configured")
 
-oauth = OAuth()
-oauth.register(
-    name = 'google',
+    if _oauth is None:
+        from authlib.integrations.starlette_client import OAuth
+        _oauth = OAuth()
+    client = _oauth.create_client(name)
+    if client is None:
+        client = _oauth.register(name = name, **config)
+
+    url = config.get('server_metadata_url')
+    if url and client.server_metadata.get('_loaded_at', 0) + METADATA_TTL <= time.time():
+        client.server_metadata.update(await load_server_metadata(url))
+    return client
+
+
+# google log in
+
+OAUTH_PROVIDERS['google'] = dict(
     server_metadata_url = 'https://accounts.google.com/.well-known/openid-configuration',
-    client_id = CLIENT_ID,
-    client_secret = CLIENT_SECRET,
+    client_id = os.environ.get('google-id', None),
+    client_secret = os.environ.get('google-secret', None),
     client_kwargs = {
         'scope': 'email openid profile',
         'redirect_url': 'http://localhost:8080/auth/google'
     }
-)    
+)
 
 
 @router.get("/login/google")
 async def login_google(request: Request): 
     url = request.url_for('auth_google')
-    return await oauth.google.authorize_redirect(request, url)
+    client = await get_oauth_client('google')
+    return await client.authorize_redirect(request, url)
 
 
 @router.get('/auth/google', response_model = Token)
-async def auth_google(request: Request, db: db_dependency): 
+async def auth_google(request: Request, db: async_db_dependency): 
+    from authlib.integrations.starlette_client import OAuthError
+    client = await get_oauth_client('google')
     try: 
-        token = await oauth.google.authorize_access_token(request)
+        token = await client.authorize_access_token(request)
     except OAuthError as error:
         raise HTTPException(status_code=400, detail=str(error))
     
     user = token.get('userinfo')
-    exists_in_user_info = db.query(UserInfo).filter(UserInfo.email == user.get('email')).first()
-
-    if not exists_in_user_info:      # if completely new user
-        if user:
-            db = SessionLocal()
-            userinfo = UserInfo(
-                email=user.get('email'), 
-                first_name=user.get('given_name'),
-                last_name=user.get('family_name'),
-                profile_created=False,           # will prompt user to fill out family profile
-                token_=token
-            )
-            db.add(userinfo)
-            db.commit()
-            db.close()
-            return {"access_token": token["access_token"], "token_type": "bearer"}
-    else:
-        exists_in_family = db.query(Family).filter(Family.email == user.get('email'))
-        if exists_in_family:              # if in family database
-            return {"access_token": token["access_token"], "token_type": "bearer"}
-        else: 
-            exists_in_user_info.profile_created = False
-    
-    raise HTTPException(status_code=400, detail="User info not found")   
-
+    if not user or not user.get('email'):
+        raise HTTPException(status_code=400, detail="User info not found")
 
-# log in with facebook
+    await resolve_login(db, user.get('email'), user.get('given_name'), user.get('family_name'), token)
+    return {"access_token": token["access_token"], "token_type": "bearer"}
 
-CLIENT_ID = os.environ.get('facebook-id', None)
-CLIENT_SECRET = os.environ.get('facebook-secret', None)
 
+# log in with facebook
 
-oauth.register(
-    name = 'facebook', 
-    client_id = CLIENT_ID,
-    client_secret = CLIENT_SECRET,
+OAUTH_PROVIDERS['facebook'] = dict(
+    client_id = os.environ.get('facebook-id', None),
+    client_secret = os.environ.get('facebook-secret', None),
     authorize_url="https://www.facebook.com/v20.0/dialog/oauth",
     access_token_url="https://graph.facebook.com/v20.0/oauth/access_token",
     api_base_url="https://graph.facebook.com/",
     client_kwargs={"scope": "email"},
-) 
+)
 
 
 @router.get("/login/facebook")
 async def login_fb(request: Request):
     redirect_uri = request.url_for("auth_fb")  
-    return await oauth.facebook.authorize_redirect(request, redirect_uri)
+    client = await get_oauth_client('facebook')
+    return await client.authorize_redirect(request, redirect_uri)
 
 
 @router.get('/auth/facebook', response_model = Token)
-async def auth_fb(request: Request, db: db_dependency):
+async def auth_fb(request: Request, db: async_db_dependency):
+    from authlib.integrations.starlette_client import OAuthError
+    client = await get_oauth_client('facebook')
     try:
-        token = await oauth.facebook.authorize_access_token(request)
+        token = await client.authorize_access_token(request)
     except OAuthError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
     # Fetch user profile from Facebook Graph API
     # fields: add/remove as needed
-    resp = await oauth.facebook.get(
+    resp = await client.get(
         "me",
         token=token,
         params={"fields": "id, first_name, last_name ,email"},
@@ -189,46 +294,17 @@ async def auth_fb(request: Request, db: db_dependency):
             detail="Facebook did not return an email. Ensure 'email' permission is granted and the FB account has an email."
         )
 
-    exists_in_user_info = (
-        db.query(UserInfo).filter(UserInfo.email == email).first()
-    )
-
-    if not exists_in_user_info:
-        userinfo = UserInfo(
-            email=email,
-            first_name=user.get("first_name"),
-            last_name=user.get("last_name"),
-            profile_created=False,
-            token_=token
-        )
-        db.add(userinfo)
-        db.commit()
-        db.refresh(userinfo)
-        return {"access_token": token["access_token"], "token_type": "bearer"}
-
-    exists_in_family = db.query(Family).filter(Family.email == email).first()
-    if exists_in_family:
-        return {"access_token": token["access_token"], "token_type": "bearer"}
-
-    exists_in_user_info.profile_created = False
-    db.commit()
+    await resolve_login(db, email, user.get("first_name"), user.get("last_name"), token)
     return {"access_token": token["access_token"], "token_type": "bearer"}
 
 
 # log in with yahoo
 
-CLIENT_ID = os.environ.get('yahoo-id', None)
-CLIENT_SECRET = os.environ.get('yahoo-secret', None)
-
-if not CLIENT_ID or not CLIENT_SECRET:
-    raise RuntimeError("Missing YAHOO_ID or YAHOO_SECRET")
-
-
-oauth.register(
-    name="yahoo",
+# missing yahoo-id / yahoo-secret answer 503 on yahoo login instead of failing at import
+OAUTH_PROVIDERS['yahoo'] = dict(
     server_metadata_url="https://api.login.yahoo.com/.well-known/openid-configuration",
-    client_id=CLIENT_ID,
-    client_secret=CLIENT_SECRET,
+    client_id=os.environ.get('yahoo-id', None),
+    client_secret=os.environ.get('yahoo-secret', None),
     client_kwargs={"scope": "openid email profile"}
 )
 
@@ -237,19 +313,22 @@ oauth.register(
 async def login_yh(request: Request):
     redirect_uri = "https://somesite.com"   # temporary. yahoo only takes https for redirect url, so i could not route it to /auth/yahoo
     print("YAHOO redirect_uri:", redirect_uri)
-    print("YAHOO client_id:", CLIENT_ID)
-    return await oauth.yahoo.authorize_redirect(request, redirect_uri)
+    client = await get_oauth_client('yahoo')
+    print("YAHOO client_id:", client.client_id)
+    return await client.authorize_redirect(request, redirect_uri)
 
 
 @router.get('/auth/yahoo', response_model = Token)
-async def auth_yh(request: Request, db: db_dependency):
+async def auth_yh(request: Request, db: async_db_dependency):
+    from authlib.integrations.starlette_client import OAuthError
+    client = await get_oauth_client('yahoo')
     try:
-        token = await oauth.yahoo.authorize_access_token(request)
+        token = await client.authorize_access_token(request)
     except OAuthError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
   
-    resp = await oauth.yahoo.get("userinfo", token=token)
+    resp = await client.get("userinfo", token=token)
     user = resp.json()
 
     email = user.get("email")
@@ -259,29 +338,7 @@ async def auth_yh(request: Request, db: db_dependency):
             detail="yahoo did not return an email. Ensure 'email' permission is granted and the yahoo account has an email."
         )
 
-    exists_in_user_info = (
-        db.query(UserInfo).filter(UserInfo.email == email).first()
-    )
-
-    if not exists_in_user_info:
-        userinfo = UserInfo(
-            email=email,
-            first_name=user.get("given_name"),
-            last_name=user.get("family_name"),
-            profile_created=False,
-            token_=token
-        )
-        db.add(userinfo)
-        db.commit()
-        db.refresh(userinfo)
-        return {"access_token": token["access_token"], "token_type": "bearer"}
-
-    exists_in_family = db.query(Family).filter(Family.email == email).first()
-    if exists_in_family:
-        return {"access_token": token["access_token"], "token_type": "bearer"}
-
-    exists_in_user_info.profile_created = False
-    db.commit()
+    await resolve_login(db, email, user.get("given_name"), user.get("family_name"), token)
     return {"access_token": token["access_token"], "token_type": "bearer"}
 
 
@@ -6,11 +6,16 @@ Version: 1.0
 Description: Endpoints handling Family object creation, update, and getting.
 """
 
-from fastapi import APIRouter,HTTPException, status
+from fastapi import APIRouter,HTTPException, status, Request, Response
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Field
+from sqlalchemy import select
 from ..models import Family, VolunteerActivities, VolunteerActivityYear, FamilyYear     # Later include UserInfo to connect with OAuth
-from .auth import db_dependency, family_dependency
+from .auth import async_db_dependency, family_dependency
+from ..sessions import family_contexts
+from ..etags import row_etag, not_modified, if_match_modified, versioned_update
+from ..serializers import column_names, model_columns
 
 
 router = APIRouter(
@@ -54,20 +59,52 @@ class CreateFamilyRequest(BaseModel):
     ins_policy: str
 
 
+# PATCH body, only the fields sent are compared and written. Every column is NOT NULL, null fields are ignored
+class UpdateFamilyRequest(BaseModel):
+    email: Optional[str] = None
+    father_fname: Optional[str] = None
+    father_lname: Optional[str] = None
+    mother_fname: Optional[str] = None
+    mother_lname: Optional[str] = None
+    father_cname: Optional[str] = None
+    mother_cname: Optional[str] = None
+    address: Optional[str] = None
+    address2: Optional[str] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    zip: Optional[str] = None
+    country: Optional[str] = None
+    email2: Optional[str] = None
+    phone: Optional[str] = None
+    phone2: Optional[str] = None
+    education: Optional[int] = None
+    income: Optional[int] = None
+    main_lang_id: Optional[str] = None
+    ecp_name: Optional[str] = None
+    ecp_relation: Optional[str] = None
+    ecp_phone: Optional[str] = None
+    medical_cond: Optional[str] = None
+    allergy: Optional[int] = None
+    doctor_name: Optional[str] = None
+    doctor_phone: Optional[str] = None
+    ins_company: Optional[str] = None
+    ins_policy: Optional[str] = None
+
+
 class NewPasswordCheck(BaseModel):
     password: str = Field(min_length=6, max_length=64)
     new_password: str = Field(min_length = 6, max_length=64)
 
 # From signup.php lines 300-335 roughly
 @router.post("/profile/create", status_code=status.HTTP_201_CREATED)
-async def initial_family_signup(db: db_dependency, req: InitialFamilyRequest):
+async def initial_family_signup(db: async_db_dependency, req: InitialFamilyRequest):
     if req.password != req.check_password:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Passwords do not match"
         )
 
-    existing_profile = db.query(Family).filter(Family.email == req.email).first()
+    existing_profile = (await db.execute(select(Family).filter(Family.email == req.email))).scalars().first()
     if existing_profile:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -130,31 +167,40 @@ async def initial_family_signup(db: db_dependency, req: InitialFamilyRequest):
     )
 
     db.add(new_family)
-    db.commit()
-    db.refresh(new_family)
+    await db.commit()
+    await db.refresh(new_family)
     return {"family_id": new_family.family_id}
 
 # From profile.php lines 26-44, returns all fields of Family object
+# Read from the database, not the family context: an edit only drops the context of the worker that saved it,
+# the profile page must show it on every worker
 @router.get("/profile/view", status_code = status.HTTP_200_OK)
-async def get_family(family: family_dependency, db: db_dependency):
-    if family is None:
+async def get_family(family: family_dependency, db: async_db_dependency, request: Request, response: Response):
+    row = (await db.execute(select(*model_columns(Family)).filter(Family.family_id == family.get('family_id')))).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Family not found")
-    return db.query(Family).filter(Family.family_id == family.get('family_id')).first()
+    profile = dict(zip(column_names(Family), row))
+
+    etag = row_etag(profile['family_id'], profile['modified'])
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return profile
 
 
 # From profile.php linles 59-65, returns Volunteer History
 @router.get("/profile/volunteer", status_code = status.HTTP_200_OK)
-async def get_family_volunteer(family: family_dependency, db: db_dependency):
+async def get_family_volunteer(family: family_dependency, db: async_db_dependency):
     if family is None:
         raise HTTPException(status_code=404, detail="Family not found")
-    volunteer_log = (db.query(VolunteerActivityYear, VolunteerActivityYear.year, VolunteerActivities.volunteer_id.label("code"), VolunteerActivities.name)
+    volunteer_log = (select(VolunteerActivityYear.year, VolunteerActivities.volunteer_id.label("code"), VolunteerActivities.name)
                     .join(VolunteerActivities, VolunteerActivities.volunteer_id == VolunteerActivityYear.volunteer_id)
                     .join(FamilyYear, FamilyYear.vay_id == VolunteerActivityYear.vay_id)
                     .filter(FamilyYear.family_id == family.get("family_id"))
                     .filter(FamilyYear.paid != 0)
     )
 
-    results = volunteer_log.all()
+    results = (await db.execute(volunteer_log)).all()
 
     final_log = []
     for row in results:
@@ -169,49 +215,47 @@ async def get_family_volunteer(family: family_dependency, db: db_dependency):
 
 
 # From edit_profile.php
+# With If-Match the UPDATE only applies to the version the client loaded, a concurrent edit answers 412
 @router.put("/profile/edit", status_code = status.HTTP_200_OK)
-async def update_family_profile(db: db_dependency, family: family_dependency, profile_change: CreateFamilyRequest):
+async def update_family_profile(db: async_db_dependency, family: family_dependency, profile_change: CreateFamilyRequest,
+                                request: Request, response: Response):
     if family is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
 
-    profile_model = db.query(Family).filter(Family.family_id == family.get('family_id')).first()
+    family_id = family.get('family_id')
+    expected = if_match_modified(request, family_id)
+    now = await versioned_update(db, Family.family_id, family_id, profile_change.model_dump(), expected)
+
+    await db.commit()
+    family_contexts.invalidate(family_id)
+    response.headers['ETag'] = row_etag(family_id, now)
+
+
+# Partial edit, the UPDATE carries only the columns whose value differs from the stored row (plus modified).
+# An edit that changes nothing writes nothing. With If-Match the UPDATE only applies to the version the client
+# loaded, like PUT, so an edit committed between the read and the write answers 412
+@router.patch("/profile/edit", status_code = status.HTTP_200_OK)
+async def patch_family_profile(db: async_db_dependency, family: family_dependency, profile_change: UpdateFamilyRequest,
+                               request: Request, response: Response):
+    expected = if_match_modified(request, family.get('family_id'))
+    profile_model = (await db.execute(select(Family).filter(Family.family_id == family.get('family_id')))).scalars().first()
     if profile_model is None:
         raise HTTPException(status_code=404, detail="Not Found")
+    if expected is not None and profile_model.modified != expected:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Profile was changed, reload it")
 
-    profile_model.father_fname = profile_change.father_fname
-    profile_model.father_lname = profile_change.father_lname
-    profile_model.mother_fname = profile_change.mother_fname
-    profile_model.mother_lname = profile_change.mother_lname
-    profile_model.father_cname = profile_change.father_cname
-    profile_model.mother_cname = profile_change.mother_cname
-    profile_model.address = profile_change.address
-    profile_model.address2 = profile_change.address2
-    profile_model.city = profile_change.city
-    profile_model.state = profile_change.state
-    profile_model.zip = profile_change.zip
-    profile_model.country = profile_change.country
-    profile_model.email = profile_change.email
-    profile_model.email2 = profile_change.email2
-    profile_model.phone = profile_change.phone
-    profile_model.phone2 = profile_change.phone2
-    profile_model.education = profile_change.education
-    profile_model.income = profile_change.income
-    profile_model.main_lang_id = profile_change.main_lang_id
-    profile_model.ecp_name = profile_change.ecp_name
-    profile_model.ecp_relation = profile_change.ecp_relation
-    profile_model.ecp_phone = profile_change.ecp_phone
-    profile_model.medical_cond = profile_change.medical_cond
-    profile_model.allergy = profile_change.allergy
-    profile_model.doctor_name = profile_change.doctor_name
-    profile_model.doctor_phone = profile_change.doctor_phone
-    profile_model.ins_company = profile_change.ins_company
-    profile_model.ins_policy = profile_change.ins_policy
+    changes = {name: value for name, value in profile_change.model_dump(exclude_unset=True, exclude_none=True).items()
+               if getattr(profile_model, name) != value}
+    if not changes:
+        response.headers['ETag'] = row_etag(profile_model.family_id, profile_model.modified)
+        return {"updated": []}
 
-    now = datetime.utcnow()
-    profile_model.modified = now
+    now = await versioned_update(db, Family.family_id, profile_model.family_id, changes, expected, profile_model.modified)
 
-    db.add(profile_model)
-    db.commit()
+    await db.commit()
+    family_contexts.invalidate(profile_model.family_id)
+    response.headers['ETag'] = row_etag(profile_model.family_id, now)
+    return {"updated": sorted(changes)}
 
 
 ''' Not needed anymore if not storing passwords
@@ -8,9 +8,13 @@ Description: Endpoints points handling Order viewing
 
 from fastapi import APIRouter,HTTPException, status
 from datetime import datetime
-from sqlalchemy import func, desc, and_
-from ..models import Family, Order, OrderStudentClass, StudentClass, Student, Classes, VolunteerActivities, VolunteerActivityYear
-from .auth import db_dependency, family_dependency
+from typing import Optional
+from pydantic import BaseModel
+from sqlalchemy import func, desc, select
+from ..models import Family, FamilyCart, Order, OrderStudentClass, StudentClass, Student, Classes, VolunteerActivities, VolunteerActivityYear
+from ..serializers import column_names, model_columns, as_dicts
+from ..history import payment_history
+from .auth import async_db_dependency, family_dependency
 
 
 router = APIRouter(
@@ -19,101 +23,88 @@ router = APIRouter(
 )
 
 
+class CartItem(BaseModel):
+    sc_id: int
+    year: int
+    student_id: int
+    class_id: int
+    wait: bool
+    paid: bool
+    paid_price: Optional[int] = None
+    created: datetime
+    removed: datetime
+    verified: bool
+    first_name: str
+    last_name: str
+    chinese_name: str
+    title: str
+    chinese_title: str
+
+
+class PaymentSummary(BaseModel):
+    order_id: int
+    year: int
+    family_id: int
+    created: datetime
+    paid: Optional[datetime] = None
+    canceled: Optional[datetime] = None
+    amount: float
+    payment_method: str
+    transaction_id: str
+    number_of_classes: int
+
+
+class OrderDetails(PaymentSummary):
+    father_fname: str
+    father_lname: str
+    mother_fname: str
+    mother_lname: str
+    father_cname: str
+    mother_cname: str
+
+
+CART_NAMES = column_names(StudentClass) + ("verified", "first_name", "last_name", "chinese_name", "title", "chinese_title")
+CART_COLUMNS = tuple(getattr(FamilyCart, name) for name in column_names(StudentClass)) + (
+    Family.verified, FamilyCart.first_name, FamilyCart.last_name, FamilyCart.chinese_name,
+    FamilyCart.title, FamilyCart.chinese_title)
+
+PAYMENT_NAMES = column_names(Order) + ("number_of_classes",)
+ORDER_DETAIL_NAMES = PAYMENT_NAMES + ("father_fname", "father_lname", "mother_fname", "mother_lname",
+                                      "father_cname", "mother_cname")
+
+
 # from checkout.php 53-72
-@router.get("/checkout", status_code = status.HTTP_200_OK)
-async def view_cart(db: db_dependency, family: family_dependency):
+# reads the family_cart projection kept by app/cart.py instead of joining students, student_class and classes
+@router.get("/checkout", status_code = status.HTTP_200_OK, response_model = list[CartItem])
+async def view_cart(db: async_db_dependency, family: family_dependency):
     current_year = datetime.now().year
 
     cart = (
-        db.query(
-            Family.verified.label("verified"),
-            Student.first_name.label("first_name"),
-            Student.last_name.label("last_name"),
-            Student.chinese_name.label("chinese_name"),
-            StudentClass,  
-            Classes.class_id.label("class_id"),
-            Classes.title.label("title"),
-            Classes.chinese_title.label("chinese_title"),
-        )
-        .select_from(Family)
-        .join(Student, Student.family_id == Family.family_id)
-        .join(
-            StudentClass,
-            and_(
-                StudentClass.student_id == Student.student_id,
-                StudentClass.paid == 0,
-                StudentClass.wait == 0,
-                StudentClass.year == current_year,
-            ),
-        )
-        .join(Classes, Classes.class_id == StudentClass.class_id)
-        .filter(Family.family_id == family.get("family_id"))
-        .order_by(Student.dob, StudentClass.class_id)
+        select(*CART_COLUMNS)
+        .join(Family, Family.family_id == FamilyCart.family_id)
+        .filter(FamilyCart.family_id == family.get("family_id"))
+        .filter(FamilyCart.year == current_year)
+        .order_by(FamilyCart.dob, FamilyCart.class_id)
     )
 
-    results = cart.all()
-
-    final_data = []
-
-    for (
-        verified,
-        first_name,
-        last_name,
-        chinese_name,
-        sc_obj,
-        class_id,
-        title,
-        chinese_title,
-    ) in results:
-
-        item = {
-            c.name: getattr(sc_obj, c.name)
-            for c in sc_obj.__table__.columns
-        }
-
-        item.update({
-            "verified": verified,
-            "first_name": first_name,
-            "last_name": last_name,
-            "chinese_name": chinese_name,
-            "class_id": class_id,
-            "title": title,
-            "chinese_title": chinese_title,
-        })
-
-        final_data.append(item)
-
-    return final_data
+    return as_dicts((await db.execute(cart)).all(), CART_NAMES)
 
 
 # From payments.php lines 30-39, returns 10 fields, 5 of which are displayed by front-end
-@router.get("/payments", status_code = status.HTTP_200_OK)
-async def view_payments(db: db_dependency, family: family_dependency):
-    order_query = (
-        db.query(Order, func.count(OrderStudentClass.osc_id).label("number_of_classes"))
-        .outerjoin(OrderStudentClass, Order.order_id == OrderStudentClass.order_id)
-        .filter(Order.family_id == family.get('family_id'))
-        .filter(Order.paid.isnot(False))   
-        .group_by(Order.order_id)
-        .order_by(Order.paid)
-        .all()
-    )
+@router.get("/payments", status_code = status.HTTP_200_OK, response_model = list[PaymentSummary])
+async def view_payments(db: async_db_dependency, family: family_dependency):
+    # past years come from order_summary, see app/history.py
+    order_query = (await db.execute(payment_history(family.get('family_id')))).all()
 
-    return [
-        {
-            **{c.key: getattr(order, c.key) for c in order.__table__.columns},
-            "number_of_classes": int(class_count),
-        }
-        for order, class_count in order_query
-    ]
+    return as_dicts(order_query, PAYMENT_NAMES)
 
 
 # From view_order.php lines 30-42, returns 16 fields, 9 of which are displayed by front-end
-@router.get("/payments/view_order_details/{order_id}")
-async def view_order_details(db: db_dependency, family: family_dependency, order_id: int):
-    order_query = (
-        db.query(Order, func.count(OrderStudentClass.osc_id).label('number_of_classes'), 
-                Family.family_id, Family.father_fname, Family.father_lname, Family.mother_fname,
+@router.get("/payments/view_order_details/{order_id}", response_model = OrderDetails)
+async def view_order_details(db: async_db_dependency, family: family_dependency, order_id: int):
+    order_query = (await db.execute(
+        select(*model_columns(Order), func.count(OrderStudentClass.osc_id).label('number_of_classes'), 
+                Family.father_fname, Family.father_lname, Family.mother_fname,
                 Family.mother_lname, Family.father_cname, Family.mother_cname)
         .select_from(Order)
         .outerjoin(OrderStudentClass, OrderStudentClass.order_id == Order.order_id)
@@ -122,26 +113,19 @@ async def view_order_details(db: db_dependency, family: family_dependency, order
         .filter(Order.family_id == family.get('family_id'))
         .filter(Order.paid.isnot(None))
         .group_by(Order.order_id)
-        .first())
+    )).first()
 
     if not order_query:
         raise HTTPException(status_code=404, detail="Order not found")
-    
-    order, number_of_classes, fam_id, father_fname, father_lname, mother_fname, mother_lname, father_cname, mother_cname = order_query
 
-    return {
-        **{c.key: getattr(order, c.key) for c in order.__table__.columns},
-        "number_of_classes": int(number_of_classes), "family_id": fam_id, "father_fname": father_fname,
-        "father_lname": father_lname, "mother_fname": mother_fname, "mother_lname": mother_lname,
-        "father_cname": father_cname, "mother_cname": mother_cname
-    }
+    return dict(zip(ORDER_DETAIL_NAMES, order_query))
 
 
 # from view_order.php lines 60-124, returns table with details on every class/product/volunteer/discount in the order
 @router.get("/payments/view_order_classes/{order_id}")
-async def view_order_classes(db: db_dependency, family: family_dependency, order_id: int):
+async def view_order_classes(db: async_db_dependency, family: family_dependency, order_id: int):
     order_query = (
-        db.query(Order.created,
+        select(Order.created,
                 Student.student_id, 
                 Student.first_name, 
                 Student.last_name, 
@@ -161,26 +145,29 @@ async def view_order_classes(db: db_dependency, family: family_dependency, order
         .order_by(desc(Student.dob), StudentClass.sc_id)
     )
 
-    if not order_query:
-        raise HTTPException(status_code=404, detail="No classes found for this order")
-
-    results = order_query.all()
+    results = (await db.execute(order_query)).all()
+
+    # volunteer logs (no student) store the volunteer_id in class_id, look up all their names at once
+    volunteer_ids = {row.class_id for row in results if row.student_id is None}
+    volunteer_names = {}
+    if volunteer_ids:
+        volunteer_names = dict((await db.execute(
+            select(VolunteerActivities.volunteer_id, VolunteerActivities.name)
+            .join(
+                VolunteerActivityYear,
+                VolunteerActivityYear.volunteer_id == VolunteerActivities.volunteer_id
+            )
+            .filter(VolunteerActivities.volunteer_id.in_(volunteer_ids))
+            .distinct()
+        )).all())
 
     # goes through every row, if it is a volunteer log (class_id == 0), then replaces row
     total = 0
     final_data = []
+    student_ids = set()
     for row in results:
     
         if row.student_id == None: 
-            # get volunteer activity
-            vol_query = (db.query(VolunteerActivities.name.label("title"))
-                .join(
-                    VolunteerActivityYear,
-                    VolunteerActivityYear.volunteer_id == VolunteerActivities.volunteer_id
-                )
-                .filter(VolunteerActivityYear.volunteer_id == row.class_id)
-                .first())    
-
             item = {
                 "created": row.created,
                 "student_id": row.student_id,
@@ -188,7 +175,7 @@ async def view_order_classes(db: db_dependency, family: family_dependency, order
                 "chinese_name": row.chinese_name,
                 "class_id": row.class_id,
                 "paid_price": str(row.paid_price), # Convert Decimal to string for JSON if needed
-                "title": vol_query.title,
+                "title": volunteer_names.get(row.class_id),
                 "chinese_title": row.chinese_title
             }
 
@@ -207,17 +194,13 @@ async def view_order_classes(db: db_dependency, family: family_dependency, order
             }
     
             final_data.append(item)
+            if row.student_id > 0:
+                student_ids.add(row.student_id)
 
         total += row.paid_price
 
-    # sibling discount   
-    student_count = (
-                db.query(func.count(func.distinct(StudentClass.student_id)))
-                .join(OrderStudentClass, OrderStudentClass.sc_id == StudentClass.sc_id)
-                .filter(OrderStudentClass.order_id == order_id)
-                .filter(StudentClass.student_id > 0)
-                .scalar()
-            )
+    # sibling discount, counted from the rows already loaded
+    student_count = len(student_ids)
     
     if student_count > 1:
             discount = (student_count - 1) * -15
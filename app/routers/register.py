@@ -6,13 +6,22 @@ Version: 1.0
 Description: Endpoints points handling student registration, current class viewing
 """
 
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy.orm import Session 
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from pydantic import BaseModel
-from ..models import Student, StudentClass, CurrentClasses
-from .auth import db_dependency, family_dependency
-from sqlalchemy import func, case
+from typing import Annotated, Optional
+from pydantic import BaseModel, Field
+from ..models import StudentClass, CurrentClasses
+from ..seats import open_counters, take_seats, release_seats
+from ..cache import TTLCache
+from ..cart import refresh_cart
+from ..serializers import column_names, model_columns, as_dicts
+from ..etags import revalidate
+from ..versions import version_query, CATALOG
+from ..sessions import family_contexts
+import hashlib
+from .auth import async_db_dependency, family_context_dependency
+from sqlalchemy import func, case, select, insert
 
 
 router = APIRouter(
@@ -24,95 +33,249 @@ class StudentRegisterRequest(BaseModel):
     class_id: int
 
 
-def verify_student(student: Student):
+class CatalogClass(BaseModel):
+    year: Optional[int] = None
+    class_id: int
+    category: Optional[str] = None
+    weight: Optional[int] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    chinese_title: Optional[str] = None
+    chinese_description: Optional[str] = None
+    class_selected: int
+
+
+class ClassSelection(BaseModel):
+    student_id: int
+    class_id: int
+
+
+class BulkRegisterRequest(BaseModel):
+    selections: list[ClassSelection] = Field(min_length=1, max_length=200)
+
+
+# student is a column dict from the family context
+def verify_student(student: dict):
     if not student: raise HTTPException(status_code=404, detail="Student not in your family")
 
-    if (not student.first_name or not student.last_name or not student.dob or student.gender is None
-        or not student.doctor_name or not student.doctor_phone
-        or not student.ins_company or not student.ins_policy):
+    if (not student['first_name'] or not student['last_name'] or not student['dob'] or student['gender'] is None
+        or not student['doctor_name'] or not student['doctor_phone']
+        or not student['ins_company'] or not student['ins_policy']):
         raise HTTPException(
             status_code=409,
             detail="Student profile incomplete. Fill required fields before registering classes.",
         )
-    
-    if student is None:
-        raise HTTPException(status_code=401, detail='Authentication Failed')
+    return student
 
 
-async def read_classes_by_category(category_order: list, student_id: int, db: Session):
-    current_year = datetime.now().year
+# Verified students of the family by student_id. Those missing from the family context or failing verify_student
+# there are read again in one query and verified on the fresh row, the cached copy may predate an edit made
+# through another worker
+async def registering_students(db: AsyncSession, context, student_ids):
+    students = {}
+    recheck = []
+    for student_id in student_ids:
+        try:
+            students[student_id] = verify_student(context.student(student_id))
+        except HTTPException:
+            recheck.append(student_id)
+
+    if recheck:
+        fresh = await family_contexts.load_students(db, context.family_id, recheck)
+        for student_id in recheck:
+            students[student_id] = verify_student(fresh.get(student_id))
+    return students
+
+
+# Student named by the student_id path parameter, checked once per request against the family context
+async def get_registering_student(student_id: int, context: family_context_dependency, db: async_db_dependency):
+    return (await registering_students(db, context, [student_id]))[student_id]
+
+
+registering_student = Annotated[dict, Depends(get_registering_student)]
+
+
+# The current-term catalog only changes when classes are rolled over, so it is cached per category list
+# together with a digest of its rows, the version its ETag is built from. The term close job bumps the catalog
+# version row, an entry built from an older version is reloaded by every worker
+CATALOG_TTL = 600
+catalog_cache = TTLCache(ttl = CATALOG_TTL)
+
+
+def invalidate_catalog():
+    catalog_cache.invalidate()
+
+
+# {'classes': column dicts, 'version': digest of the rows} of the category list, one lookup per request
+async def catalog_entry(category_order: list, db: AsyncSession):
+    key = tuple(category_order)
+    current_version = (await db.execute(version_query(CATALOG))).scalar() or 0
+    entry = catalog_cache.get(key)
+    if entry is not None and entry['catalog_version'] == current_version:
+        return entry
+
     category_rank = case(
         {cat: i for i, cat in enumerate(category_order)},
         value=CurrentClasses.category,
         else_=len(category_order)
     )
 
-    class_query = (
-        db.query(
-            CurrentClasses,
-            func.count(StudentClass.student_id).label("is_selected")
-        )
-        .outerjoin(StudentClass, 
-            (StudentClass.class_id == CurrentClasses.class_id) &
-            (StudentClass.student_id == student_id) &
-            (StudentClass.year == current_year) &
-            ((StudentClass.paid == 0) | (StudentClass.paid.is_(None)))
-        )
+    results = (await db.execute(
+        select(*model_columns(CurrentClasses))
         .filter(CurrentClasses.category.in_(category_order))
-        .group_by(CurrentClasses.class_id)
         .order_by(category_rank, CurrentClasses.weight)
-    )
+    )).all()
+
+    entry = {
+        'classes': as_dicts(results, column_names(CurrentClasses)),
+        'version': hashlib.sha1(repr(results).encode()).hexdigest(),
+        'catalog_version': current_version,
+    }
+    catalog_cache.set(key, entry)
+    return entry
+
+
+# {class_id: (selections, last sc_id)} of the student's unpaid classes this year, one grouped query per request
+async def read_selected(student_id: int, db: AsyncSession):
+    return {class_id: (count, last) for class_id, count, last in (await db.execute(
+        select(StudentClass.class_id, func.count(StudentClass.sc_id), func.max(StudentClass.sc_id))
+        .filter(StudentClass.student_id == student_id)
+        .filter(StudentClass.year == datetime.now().year)
+        .filter((StudentClass.paid == 0) | (StudentClass.paid.is_(None)))
+        .group_by(StudentClass.class_id)
+    )).all()}
+
 
-    results = class_query.all()
+# Changes with every selection, removal or payment of the student's classes this year
+def selection_version(selected: dict):
+    return sum(count for count, _ in selected.values()), max((last for _, last in selected.values()), default=None)
 
+
+def read_classes_by_category(catalog: list, selected: dict):
     final_data = []
-    for class_obj, count in results:
-        item = {c.name: getattr(class_obj, c.name) for c in class_obj.__table__.columns}
-        item["class_selected"] = count
+    for class_item in catalog:
+        item = dict(class_item)
+        item["class_selected"] = selected.get(item["class_id"], (0, None))[0]
         final_data.append(item) 
 
 
     return final_data
 
 # From select_classes.php lines 69-76
-@router.get("/{student_id}/read_current_LC_classes", status_code = status.HTTP_200_OK)
-async def read_current_LC_classes(student_id: int, db: db_dependency, family: family_dependency):
-    student = db.query(Student).filter(Student.student_id == student_id, Student.family_id == family.get('family_id')).first()
-    verify_student(student)
+@router.get("/{student_id}/read_current_LC_classes", status_code = status.HTTP_200_OK, response_model = list[CatalogClass])
+async def read_current_LC_classes(student_id: int, db: async_db_dependency, student: registering_student,
+                                  request: Request, response: Response):
     category_order = ['LC', 'CSL', 'AC', 'SP-FULL','SP-HALF','SP-EC','BOOK', 'SP-lang', 'SP-AC']
-    return await read_classes_by_category(category_order, student_id, db)
+    catalog = await catalog_entry(category_order, db)
+    selected = await read_selected(student_id, db)
+    revalidate(request, response, catalog['version'], *selection_version(selected))
+    return read_classes_by_category(catalog['classes'], selected)
     
     
 # From select_classes2.php lines 82-88    
-@router.get("/{student_id}/read_current_EP_classes", status_code = status.HTTP_200_OK)
-async def read_current_EP_classes(student_id: int, db: db_dependency, family: family_dependency):
-    student = db.query(Student).filter(Student.student_id == student_id, Student.family_id == family.get('family_id')).first()
-    verify_student(student)
+@router.get("/{student_id}/read_current_EP_classes", status_code = status.HTTP_200_OK, response_model = list[CatalogClass])
+async def read_current_EP_classes(student_id: int, db: async_db_dependency, student: registering_student,
+                                  request: Request, response: Response):
     category_order = category_order = ['EP','EP-AM', 'SP-EP']
-    return await read_classes_by_category(category_order, student_id, db)   
+    catalog = await catalog_entry(category_order, db)
+    selected = await read_selected(student_id, db)
+    revalidate(request, response, catalog['version'], *selection_version(selected))
+    return read_classes_by_category(catalog['classes'], selected)   
 
 
 # From select_classes.php 
 # Simply asks for class_id and adds to StudentClass
 # Endpoint used by with frontend checkboxes. Frontend sends the class as input. Frontend ensures there are no duplicated
+# Once seats_x seats are taken for the year, the student is placed on the waitlist (wait = 1)
 @router.post("/{student_id}/select_classes", status_code = status.HTTP_201_CREATED)
-async def select_classes(student_id: int, db: db_dependency, family: family_dependency, register: StudentRegisterRequest):
-    student = db.query(Student).filter(Student.student_id == student_id, Student.family_id == family.get('family_id')).first()
-    verify_student(student)
-    
+async def select_classes(student_id: int, db: async_db_dependency, student: registering_student, register: StudentRegisterRequest):
     current_year = datetime.now().year
     now = datetime.now()
-    
+
+    if not await open_counters(db, current_year, [register.class_id]):
+        raise HTTPException(status_code=404, detail="Class not found")
+    has_seat = (await take_seats(db, current_year, {register.class_id: 1}))[register.class_id] == 1
+
     class_list = StudentClass(
         year = current_year,
         student_id = student_id,
         class_id = register.class_id, # user input
-        wait = 0,        
-        paid = 0,      
+        wait = 0 if has_seat else 1,
+        paid = 0,
         created = now,
         removed = now  # fix: use datetime, not 0
     )
 
-    db.add(class_list)
-    db.commit()
+    # the seat is already taken and committed, the class row is not locked while the cart is refreshed
+    try:
+        db.add(class_list)
+        if has_seat:
+            await db.flush()
+            await refresh_cart(db, student['family_id'], current_year)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        if has_seat:
+            await release_seats(db, current_year, {register.class_id: 1})
+        raise
+
+    return {"class_id": register.class_id, "wait": not has_seat}
+
+
+# Batch version of select_classes for the whole family: ownership from the family context, one duplicate check,
+# one seat update per distinct class, then one executemany insert and one commit. Pairs already registered this
+# year are skipped
+@router.post("/select_classes", status_code = status.HTTP_201_CREATED)
+async def select_classes_bulk(db: async_db_dependency, context: family_context_dependency, register: BulkRegisterRequest):
+    current_year = datetime.now().year
+    now = datetime.now()
+
+    pairs = list(dict.fromkeys((s.student_id, s.class_id) for s in register.selections))
+    student_ids = {student_id for student_id, _ in pairs}
+    class_ids = {class_id for _, class_id in pairs}
+
+    await registering_students(db, context, student_ids)
+
+    existing = set((await db.execute(
+        select(StudentClass.student_id, StudentClass.class_id)
+        .filter(StudentClass.student_id.in_(student_ids))
+        .filter(StudentClass.class_id.in_(class_ids))
+        .filter(StudentClass.year == current_year)
+    )).all())
+    new_pairs = [pair for pair in pairs if pair not in existing]
+
+    if new_pairs and not await open_counters(db, current_year, {class_id for _, class_id in new_pairs}):
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    wanted = {}
+    for _, class_id in new_pairs:
+        wanted[class_id] = wanted.get(class_id, 0) + 1
+    granted = await take_seats(db, current_year, wanted) if wanted else {}
+
+    # the first students of each class in request order get its granted seats, the others are waitlisted
+    seats_left = dict(granted)
+    rows = []
+    for student_id, class_id in new_pairs:
+        has_seat = seats_left[class_id] > 0
+        seats_left[class_id] -= has_seat
+        rows.append({"student_id": student_id, "class_id": class_id, "wait": not has_seat})
+
+    try:
+        if rows:
+            await db.execute(insert(StudentClass), [
+                {"year": current_year, "student_id": row["student_id"], "class_id": row["class_id"],
+                 "wait": 1 if row["wait"] else 0, "paid": 0, "created": now, "removed": now}
+                for row in rows
+            ])
+        if any(granted.values()):
+            await refresh_cart(db, context.family_id, current_year)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await release_seats(db, current_year, granted)
+        raise
 
+    return {
+        "registered": rows,
+        "skipped": [{"student_id": student_id, "class_id": class_id} for student_id, class_id in pairs if (student_id, class_id) in existing],
+    }
@@ -6,12 +6,17 @@ Version: 1.0
 Description: Endpoints handling Student object creation, update, and getting.
 """
 
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import desc
+from fastapi import APIRouter, HTTPException, status, Request, Response
+from sqlalchemy import desc, select, func
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 from ..models import Student, StudentClass, Classes
-from .auth import db_dependency, family_dependency
+from ..cart import refresh_cart
+from .auth import async_db_dependency, family_dependency, student_dependency
+from ..sessions import family_contexts
+from ..etags import row_etag, list_etag, not_modified, if_match_modified, versioned_update, revalidate
+from ..serializers import column_names, model_columns, as_dicts
 
 
 router = APIRouter(
@@ -35,17 +40,67 @@ class CreateStudentRequest(BaseModel):
     ins_policy: str
 
 
+# PATCH body, only the fields sent are compared and written. Every column is NOT NULL, null fields are ignored
+class UpdateStudentRequest(BaseModel):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    chinese_name: Optional[str] = None
+    dob: Optional[str] = None
+    gender: Optional[str] = None
+    grade: Optional[str] = None
+    email: Optional[str] = None
+    medical_cond: Optional[str] = None
+    allergy: Optional[str] = None
+    doctor_name: Optional[str] = None
+    doctor_phone: Optional[str] = None
+    ins_company: Optional[str] = None
+    ins_policy: Optional[str] = None
+
+
+# columns copied into family_cart, changing one of them refreshes the cart
+CART_STUDENT_COLUMNS = {'first_name', 'last_name', 'chinese_name', 'dob'}
+
+
 # From students.php lines 32-37 
+# Profile reads come from the database, not the family context: an edit only drops the context of the worker that
+# saved it, the students page must show it on every worker
 @router.get("/student", status_code = status.HTTP_200_OK)
-async def get_students_by_family(family: family_dependency, db: db_dependency):
-    if family is None:
-        raise HTTPException(status_code=404, detail="Family not found")
-    return db.query(Student).filter(Student.family_id == family.get('family_id')).order_by(Student.dob).all()
+async def get_students_by_family(family: family_dependency, db: async_db_dependency, request: Request, response: Response):
+    family_id = family.get('family_id')
+    students = as_dicts((await db.execute(
+        select(*model_columns(Student)).filter(Student.family_id == family_id).order_by(Student.dob)
+    )).all(), column_names(Student))
+
+    etag = list_etag(family_id, ((student['student_id'], student['modified']) for student in students))
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return students
+
+
+# One student with its ETag, the version a later If-Match edit of the student refers to.
+# student_dependency checks ownership, the row itself is read fresh
+@router.get("/student/{student_id}", status_code = status.HTTP_200_OK)
+async def get_student(student: student_dependency, db: async_db_dependency, request: Request, response: Response):
+    row = (await db.execute(
+        select(*model_columns(Student))
+        .filter(Student.student_id == student['student_id'])
+        .filter(Student.family_id == student['family_id'])
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    profile = dict(zip(column_names(Student), row))
+
+    etag = row_etag(profile['student_id'], profile['modified'])
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return profile
 
 
 # From add_student.php
 @router.post("/student/add", status_code = status.HTTP_201_CREATED)
-async def create_child(db: db_dependency, family: family_dependency, child_request: CreateStudentRequest):
+async def create_child(db: async_db_dependency, family: family_dependency, child_request: CreateStudentRequest):
     if family is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     now = datetime.utcnow()
@@ -72,52 +127,86 @@ async def create_child(db: db_dependency, family: family_dependency, child_reque
     
 
     db.add(child_model)
-    db.commit()
+    await db.commit()
+    family_contexts.invalidate(family.get('family_id'))
 
 # From edit_student.php lines 28-63
+# The student is already loaded and verified by student_dependency, the edit is a single UPDATE.
+# With If-Match it only applies to the version the client loaded, a concurrent edit answers 412
 @router.put("/student/{student_id}", status_code = status.HTTP_200_OK)
-async def update_student_profile(db: db_dependency, student_id: int, child_request: CreateStudentRequest, family: family_dependency):
-    student = db.query(Student).filter(Student.student_id == student_id, Student.family_id == family.get('family_id')).first()
-    if student is None:
-        raise HTTPException(status_code=401, detail='Authentication Failed')
-
-    profile_model = db.query(Student).filter(Student.student_id == student_id).first()
+async def update_student_profile(db: async_db_dependency, student: student_dependency, child_request: CreateStudentRequest,
+                                 request: Request, response: Response):
+    expected = if_match_modified(request, student['student_id'])
+    now = await versioned_update(db, Student.student_id, student['student_id'], dict(
+        first_name = child_request.first_name,
+        last_name = child_request.last_name,
+        chinese_name = child_request.chinese_name,
+        gender = child_request.gender,
+        grade = child_request.grade,
+        dob = child_request.dob,
+        medical_cond = child_request.medical_cond,
+        allergy = child_request.allergy,
+        doctor_name = child_request.doctor_name,
+        doctor_phone = child_request.doctor_phone,
+        ins_company = child_request.ins_company,
+        ins_policy = child_request.ins_policy,
+        email = child_request.email,
+    ), expected)
+
+    await refresh_cart(db, student['family_id'], datetime.now().year)     # cart rows carry the student's names
+    await db.commit()
+    family_contexts.invalidate(student['family_id'])
+    response.headers['ETag'] = row_etag(student['student_id'], now)
+
+
+# Partial edit, the UPDATE carries only the columns whose value differs from the stored row (plus modified).
+# An edit that changes nothing writes nothing. With If-Match the UPDATE only applies to the version the client
+# loaded, like PUT, so an edit committed between the read and the write answers 412
+@router.patch("/student/{student_id}", status_code = status.HTTP_200_OK)
+async def patch_student_profile(db: async_db_dependency, student: student_dependency, child_request: UpdateStudentRequest,
+                                request: Request, response: Response):
+    expected = if_match_modified(request, student['student_id'])
+    profile_model = await db.get(Student, student['student_id'])
     if profile_model is None:
         raise HTTPException(status_code=404, detail="Not Found")
+    if expected is not None and profile_model.modified != expected:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Profile was changed, reload it")
+    changes = {name: value for name, value in child_request.model_dump(exclude_unset=True, exclude_none=True).items()
+               if getattr(profile_model, name) != value}
+    if not changes:
+        response.headers['ETag'] = row_etag(profile_model.student_id, profile_model.modified)
+        return {"updated": []}
 
-    profile_model.first_name = child_request.first_name
-    profile_model.last_name = child_request.last_name
-    profile_model.chinese_name = child_request.chinese_name
-    profile_model.gender = child_request.gender
-    profile_model.grade = child_request.grade
-    profile_model.dob = child_request.dob
-    profile_model.medical_cond = child_request.medical_cond
-    profile_model.allergy = child_request.allergy
-    profile_model.doctor_name = child_request.doctor_name
-    profile_model.doctor_phone = child_request.doctor_phone
-    profile_model.ins_company = child_request.ins_company
-    profile_model.ins_policy = child_request.ins_policy
-    profile_model.email = child_request.email
+    now = await versioned_update(db, Student.student_id, student['student_id'], changes, expected, profile_model.modified)
 
-    db.add(profile_model)
-    db.commit()
+    if CART_STUDENT_COLUMNS & changes.keys():
+        await refresh_cart(db, student['family_id'], datetime.now().year)
+    await db.commit()
+    family_contexts.invalidate(student['family_id'])
+    response.headers['ETag'] = row_etag(student['student_id'], now)
+    return {"updated": sorted(changes)}
 
 
 # From edit_student.php lines 65-70
 @router.get("/student/{student_id}/registration_history", status_code = status.HTTP_200_OK)
-async def view_student_history(db: db_dependency, student_id: int, family: family_dependency):
-    student = db.query(Student).filter(Student.student_id == student_id, Student.family_id == family.get('family_id')).first()
-    if student is None:
-        raise HTTPException(status_code=401, detail='Authentication Failed')
-    
+async def view_student_history(db: async_db_dependency, student: student_dependency, request: Request, response: Response):
+    # paid classes only change at checkout and term close, class titles with Classes.modified
+    version = (await db.execute(
+        select(func.count(StudentClass.sc_id), func.max(StudentClass.sc_id), func.max(Classes.modified))
+        .join(Classes, Classes.class_id == StudentClass.class_id)
+        .filter(StudentClass.student_id == student['student_id'])
+        .filter(StudentClass.paid != 0)
+    )).one()
+    revalidate(request, response, *version)
+
     history = (
-        db.query(StudentClass, StudentClass.year, Classes.class_code, Classes.title, Classes.chinese_title)
+        select(StudentClass.year, Classes.class_code, Classes.title, Classes.chinese_title)
         .join(Classes, Classes.class_id == StudentClass.class_id)
-        .filter(StudentClass.student_id == student_id)
+        .filter(StudentClass.student_id == student['student_id'])
         .filter(StudentClass.paid != 0)
     )
 
-    results = history.all()
+    results = (await db.execute(history)).all()
     final_history = []
     for row in results:
         item = {
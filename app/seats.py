@@ -0,0 +1,131 @@
+"""
+Filename: seats.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Seat reservation for registration. Taken seats are kept per (year, class_id) in class_seats, a seat is
+             taken by one conditional UPDATE of that row (taken + n <= seats_x) committed right away, so the row is
+             locked for a single statement and no click counts student_class. The in-process counter only remembers
+             classes found full, so later clicks go straight to the waitlist.
+"""
+
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from .cache import TTLCache
+from .models import Classes, ClassSeats, StudentClass
+
+
+class SeatCounter:
+    """
+    Classes (keyed by (year, class_id)) the database reported full. A hint only: it is never used to hand out a
+    seat, and entries expire after ttl seconds so seats freed by other workers or manual edits are offered again.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._full = TTLCache(ttl = ttl)
+
+    def is_full(self, key) -> bool:
+        return self._full.get(key, False)
+
+    def mark_full(self, key):
+        self._full.set(key, True)
+
+    def invalidate(self, key=None):
+        self._full.invalidate(key)
+
+
+seat_counter = SeatCounter()
+
+
+def counter_insert(dialect: str, year: int, class_ids):
+    """class_seats rows of class_ids counted from student_class, rows another request created first are kept."""
+    taken = (
+        select(func.count(StudentClass.sc_id))
+        .filter(StudentClass.year == year)
+        .filter(StudentClass.class_id == Classes.class_id)
+        .filter(StudentClass.wait == 0)
+        .scalar_subquery()
+    )
+    rows = select(literal(year), Classes.class_id, taken).filter(Classes.class_id.in_(class_ids))
+    columns = ['year', 'class_id', 'taken']
+    if dialect == 'mysql':
+        return mysql.insert(ClassSeats).from_select(columns, rows).prefix_with('IGNORE')
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    return insert(ClassSeats).from_select(columns, rows).on_conflict_do_nothing(
+        index_elements = [ClassSeats.year, ClassSeats.class_id])
+
+
+async def open_counters(db, year: int, class_ids) -> bool:
+    """
+    Makes sure class_ids have their class_seats row for year, counting the missing ones once and committing.
+    Returns False when one of the classes does not exist.
+    """
+    class_ids = set(class_ids)
+    counted = select(ClassSeats.class_id).filter(ClassSeats.year == year).filter(ClassSeats.class_id.in_(class_ids))
+    missing = class_ids - set((await db.execute(counted)).scalars().all())
+    if not missing:
+        return True
+
+    await db.execute(counter_insert(db.get_bind().dialect.name, year, missing))
+    await db.commit()
+    return len((await db.execute(counted)).scalars().all()) == len(class_ids)
+
+
+def capacity(class_id: int):
+    return select(Classes.seats_x).filter(Classes.class_id == class_id).scalar_subquery()
+
+
+def seat_update(year: int, class_id: int, count: int):
+    """Takes count seats at once, rowcount is 0 when fewer are left."""
+    return (
+        update(ClassSeats)
+        .where(ClassSeats.year == year, ClassSeats.class_id == class_id)
+        .where(ClassSeats.taken + count <= capacity(class_id))
+        .values(taken = ClassSeats.taken + count)
+    )
+
+
+async def free_seats(db, year: int, class_id: int) -> int:
+    free = (await db.execute(
+        select(capacity(class_id) - ClassSeats.taken)
+        .filter(ClassSeats.year == year, ClassSeats.class_id == class_id)
+    )).scalar()
+    return max(free or 0, 0)
+
+
+async def take_seats(db, year: int, wanted: dict) -> dict:
+    """
+    Takes up to wanted[class_id] seats per class (counters opened with open_counters) and commits, one UPDATE per
+    class in class_id order so two requests cannot deadlock. Returns the seats granted per class, the rest of the
+    students go on the waitlist. Give seats back with release_seats when the registration is not saved.
+    """
+    granted = {}
+    try:
+        for class_id in sorted(wanted):
+            key = (year, class_id)
+            count = 0 if seat_counter.is_full(key) else wanted[class_id]
+            while count and (await db.execute(seat_update(year, class_id, count))).rowcount == 0:
+                # fewer seats left than asked for, take the ones that are
+                count = 0 if count == 1 else min(count - 1, await free_seats(db, year, class_id))
+            if count < wanted[class_id]:
+                seat_counter.mark_full(key)
+            granted[class_id] = count
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return granted
+
+
+async def release_seats(db, year: int, granted: dict):
+    for class_id, count in granted.items():
+        if count:
+            await db.execute(
+                update(ClassSeats)
+                .where(ClassSeats.year == year, ClassSeats.class_id == class_id)
+                .values(taken = ClassSeats.taken - count)
+            )
+            seat_counter.invalidate((year, class_id))
+    await db.commit()
+
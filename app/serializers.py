@@ -0,0 +1,25 @@
+"""
+Filename: serializers.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Column-tuple serialization. Queries select a model's columns as plain tuples instead of ORM objects,
+             and rows are zipped with the column names computed once per model.
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def column_names(model):
+    return tuple(c.key for c in model.__table__.columns)
+
+
+@lru_cache(maxsize=None)
+def model_columns(model):
+    """Column attributes of model in table order, for select(*model_columns(Model))."""
+    return tuple(getattr(model, name) for name in column_names(model))
+
+
+def as_dicts(rows, names):
+    return [dict(zip(names, row)) for row in rows]
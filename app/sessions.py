@@ -0,0 +1,136 @@
+"""
+Filename: sessions.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Server-side session data. The family context (family row and its students) is loaded once and kept in
+             a pluggable store, so routers check student ownership against a set instead of querying Student.
+             Profile pages read their rows fresh, the context is only invalidated in the worker that made an edit.
+             MemoryStore keeps entries in the worker; a shared backend only has to implement SessionStore.
+"""
+
+from abc import ABC, abstractmethod
+from sqlalchemy import select
+from .cache import TTLCache
+from .models import Family, Student
+from .serializers import column_names, model_columns
+
+# seconds a family context is kept. Edits made through the routers invalidate it in their own worker only, other
+# workers pick them up when the entry expires, or right away for a student missing from their copy
+FAMILY_CONTEXT_TTL = 60
+FAMILY_CONTEXT_SIZE = 10000
+
+
+class SessionStore(ABC):
+    """Backend interface. Values are plain dicts and lists."""
+
+    @abstractmethod
+    def get(self, key: str):
+        """Value stored under key, None when missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float):
+        """Stores value under key for ttl seconds."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Removes key, a missing key is not an error."""
+
+    @abstractmethod
+    def clear(self):
+        """Removes every key."""
+
+
+class MemoryStore(SessionStore):
+    def __init__(self, maxsize: int = None):
+        self._cache = TTLCache(ttl = 0, maxsize = maxsize)
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value, ttl: float):
+        self._cache.set(key, value, ttl = ttl)
+
+    def delete(self, key: str):
+        self._cache.invalidate(key)
+
+    def clear(self):
+        self._cache.invalidate()
+
+
+class FamilyContext:
+    """Family columns and the family's students (column dicts ordered by dob)."""
+
+    def __init__(self, family: dict, students: list):
+        self.family = family
+        self.students = students
+        self._students = {student['student_id']: student for student in students}
+
+    @property
+    def family_id(self):
+        return self.family['family_id']
+
+    @property
+    def student_ids(self):
+        return self._students.keys()
+
+    def owns(self, student_id: int):
+        return student_id in self._students
+
+    def student(self, student_id: int):
+        return self._students.get(student_id)
+
+
+class FamilyContexts:
+    def __init__(self, store: SessionStore, ttl: float = FAMILY_CONTEXT_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    @staticmethod
+    def key(family_id: int):
+        return f"family:{family_id}"
+
+    async def load(self, db, family_id: int):
+        """Returns the FamilyContext of family_id, None if the family does not exist."""
+        cached = self.store.get(self.key(family_id))
+        if cached is not None:
+            return FamilyContext(cached['family'], cached['students'])
+
+        family = (await db.execute(select(*model_columns(Family)).filter(Family.family_id == family_id))).first()
+        if family is None:
+            return None
+        students = (await db.execute(
+            select(*model_columns(Student)).filter(Student.family_id == family_id).order_by(Student.dob)
+        )).all()
+
+        value = {
+            'family': dict(zip(column_names(Family), family)),
+            'students': [dict(zip(column_names(Student), row)) for row in students],
+        }
+        self.store.set(self.key(family_id), value, self.ttl)
+        return FamilyContext(value['family'], value['students'])
+
+    async def load_students(self, db, family_id: int, student_ids):
+        """
+        Student column dicts of family_id read straight from the database in one query, keyed by student_id, for a
+        student the cached context is missing or holds an outdated copy of (edited through another worker). Students
+        not in the family are left out. The cached context is dropped when it turned out stale.
+        """
+        rows = (await db.execute(
+            select(*model_columns(Student))
+            .filter(Student.family_id == family_id)
+            .filter(Student.student_id.in_(student_ids))
+        )).all()
+        students = {student['student_id']: student for student in (dict(zip(column_names(Student), row)) for row in rows)}
+        if students:
+            self.invalidate(family_id)
+        return students
+
+    def invalidate(self, family_id: int = None):
+        if family_id is None:
+            self.store.clear()
+        else:
+            self.store.delete(self.key(family_id))
+
+
+family_contexts = FamilyContexts(MemoryStore(maxsize = FAMILY_CONTEXT_SIZE))
@@ -0,0 +1,170 @@
+"""
+Filename: term.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Term close batch job. Marks classes of paid orders as paid, archives the closed term's student_class rows
+             and drops its unpaid ones, rolls current_classes over from classes and opens family_year for the new year.
+             Work is done in key-range chunks, each in its own transaction, with a checkpoint per chunk in
+             batch_progress so an interrupted run picks up where it stopped.
+             Run from the project root: python -m app.term --year 2026
+"""
+
+import argparse
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, func, literal, exists, and_, null
+from .database import engine
+from .models import (StudentClass, StudentClassArchive, OrderStudentClass, Order, Classes, CurrentClasses,
+                     FamilyYear, BatchProgress)
+from .cart import rebuild_carts
+from .history import summarize_past_orders
+from .versions import bump_version, CATALOG
+
+CHUNK_SIZE = 5000
+
+
+def save_progress(connection, job: str, last_key: int, done: bool):
+    values = {'last_key': last_key, 'done': done, 'updated': datetime.utcnow()}
+    if connection.execute(update(BatchProgress).where(BatchProgress.job == job).values(**values)).rowcount == 0:
+        connection.execute(insert(BatchProgress).values(job = job, **values))
+
+
+def run_chunked(bind, job: str, key, statements, chunk_size: int = CHUNK_SIZE):
+    """
+    Runs statements(low, high) for consecutive ranges low < key <= high, one transaction per range.
+    Returns the number of rows changed, 0 if the job already finished.
+    """
+    with bind.connect() as connection:
+        progress = connection.execute(select(BatchProgress).where(BatchProgress.job == job)).first()
+        max_key = connection.scalar(select(func.max(key))) or 0
+    if progress is not None and progress.done:
+        return 0
+
+    changed = 0
+    low = progress.last_key if progress is not None else 0
+    while low < max_key:
+        high = low + chunk_size
+        with bind.begin() as connection:
+            for statement in statements(low, high):
+                changed += connection.execute(statement).rowcount
+            save_progress(connection, job, high, done = False)
+        low = high
+
+    with bind.begin() as connection:
+        save_progress(connection, job, low, done = True)
+    return changed
+
+
+def in_range(key, low: int, high: int):
+    return and_(key > low, key <= high)
+
+
+def mark_paid(bind, year: int, chunk_size: int = CHUNK_SIZE):
+    """Sets paid on the term's student_class rows that belong to a paid, not canceled order."""
+    paid_classes = (
+        select(OrderStudentClass.sc_id)
+        .join(Order, Order.order_id == OrderStudentClass.order_id)
+        .where(Order.paid.isnot(None), Order.canceled.is_(None))
+    )
+
+    def statements(low, high):
+        yield (
+            update(StudentClass)
+            .where(in_range(StudentClass.sc_id, low, high))
+            .where(StudentClass.year == year, StudentClass.paid == 0)
+            .where(StudentClass.sc_id.in_(paid_classes))
+            .values(paid = 1)
+            .execution_options(synchronize_session = False)
+        )
+
+    return run_chunked(bind, f"close_term:{year}:mark_paid", StudentClass.sc_id, statements, chunk_size)
+
+
+def archive_student_classes(bind, year: int, chunk_size: int = CHUNK_SIZE):
+    """
+    Copies student_class rows of the term and earlier into student_class_archive and removes the unpaid ones
+    (abandoned carts, waitlist). Paid rows stay, registration history and orders still read them.
+    """
+    now = datetime.utcnow()
+    columns = ['sc_id', 'year', 'student_id', 'class_id', 'wait', 'paid', 'paid_price', 'created', 'removed', 'archived']
+    not_archived = ~exists().where(StudentClassArchive.sc_id == StudentClass.sc_id)
+
+    def statements(low, high):
+        yield insert(StudentClassArchive).from_select(columns, (
+            select(StudentClass.sc_id, StudentClass.year, StudentClass.student_id, StudentClass.class_id,
+                   StudentClass.wait, StudentClass.paid, StudentClass.paid_price, StudentClass.created,
+                   StudentClass.removed, literal(now, StudentClassArchive.archived.type))
+            .where(in_range(StudentClass.sc_id, low, high))
+            .where(StudentClass.year <= year)
+            .where(not_archived)
+        ))
+        yield (
+            delete(StudentClass)
+            .where(in_range(StudentClass.sc_id, low, high))
+            .where(StudentClass.year <= year, StudentClass.paid == 0)
+            .execution_options(synchronize_session = False)
+        )
+
+    return run_chunked(bind, f"close_term:{year}:archive", StudentClass.sc_id, statements, chunk_size)
+
+
+def roll_over_classes(bind, new_year: int):
+    """
+    Replaces current_classes with every class in classes for new_year. The catalog is small, one transaction,
+    which also bumps the catalog version so every worker drops its cached catalog.
+    """
+    columns = ['year', 'class_id', 'category', 'weight', 'title', 'description', 'chinese_title', 'chinese_description']
+    with bind.begin() as connection:
+        connection.execute(delete(CurrentClasses))
+        rows = connection.execute(insert(CurrentClasses).from_select(columns, (
+            select(literal(new_year), Classes.class_id, Classes.category, Classes.weight, Classes.title,
+                   Classes.description, Classes.chinese_title, Classes.chinese_description)
+        ))).rowcount
+        bump_version(connection, CATALOG)
+        return rows
+
+
+def reset_family_year(bind, year: int, new_year: int, chunk_size: int = CHUNK_SIZE):
+    """Opens an unpaid family_year row for new_year for every family that had one in year."""
+    columns = ['year', 'family_id', 'paid', 'vay_id']
+    NewYear = FamilyYear.__table__.alias('new_year')
+    not_opened = ~exists().where(NewYear.c.family_id == FamilyYear.family_id, NewYear.c.year == new_year)
+
+    def statements(low, high):
+        yield insert(FamilyYear).from_select(columns, (
+            select(literal(new_year), FamilyYear.family_id, literal(0), null())
+            .where(in_range(FamilyYear.family_id, low, high))
+            .where(FamilyYear.year == year)
+            .where(not_opened)
+        ))
+
+    return run_chunked(bind, f"close_term:{year}:family_year", FamilyYear.family_id, statements, chunk_size)
+
+
+def close_term(bind, year: int, new_year: int, chunk_size: int = CHUNK_SIZE):
+    # rows changed per step
+    results = {
+        'mark_paid': mark_paid(bind, year, chunk_size),
+        'archive': archive_student_classes(bind, year, chunk_size),
+        'current_classes': roll_over_classes(bind, new_year),
+        'family_year': reset_family_year(bind, year, new_year, chunk_size),
+        'order_summary': summarize_past_orders(bind, new_year),
+    }
+    rebuild_carts(bind, new_year)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Close a term and open the next one")
+    parser.add_argument('--year', type = int, default = datetime.now().year, help = 'term being closed')
+    parser.add_argument('--new-year', type = int, help = 'term being opened, defaults to year + 1')
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_SIZE)
+    args = parser.parse_args()
+
+    results = close_term(engine, args.year, args.new_year or args.year + 1, args.chunk_size)
+    for step, rows in results.items():
+        print(f"{step:16} {rows}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Filename: versions.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Version counters in cache_version. A job that rewrites cached data bumps its counter in the same
+             transaction, every worker compares the counter with the one its cached copy was built from, so a
+             change made by one process is seen by all of them on their next read.
+"""
+
+from datetime import datetime
+from sqlalchemy import select, insert, update
+from .models import CacheVersion
+
+# current_classes, rewritten by the term close job
+CATALOG = 'catalog'
+
+
+def bump_version(connection, name: str):
+    values = {'version': CacheVersion.version + 1, 'updated': datetime.utcnow()}
+    if connection.execute(update(CacheVersion).where(CacheVersion.name == name).values(**values)).rowcount == 0:
+        connection.execute(insert(CacheVersion).values(name = name, version = 1, updated = datetime.utcnow()))
+
+
+def version_query(name: str):
+    """Selects the counter of name, no row means version 0."""
+    return select(CacheVersion.version).where(CacheVersion.name == name)
@@ -0,0 +1,120 @@
+"""
+Filename: bench_compression.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Bytes on the wire and compression CPU per endpoint. Seeds a database with the load test's data, fetches
+             the large JSON/CSV endpoints through the app with each Accept-Encoding and times the codec alone on the
+             identity body (brotli only when the package is installed).
+             Run from the project root: python -m bench.bench_compression
+"""
+
+import os
+os.environ.setdefault('TESTING', '1')
+os.environ.setdefault('ADMIN_EMAILS', 'family1@e.com')      # the admin endpoints are measured too
+
+import argparse
+import asyncio
+import gzip
+import random
+import time
+from datetime import datetime
+
+import httpx
+
+from app.compression import GZIP_LEVEL, BROTLI_QUALITY, brotli
+from app.main import app
+from bench.bench_load import seed, use_database
+
+ROUNDS = 20
+
+
+def endpoints(student_id: int, order_id: int, year: int):
+    return [
+        ('catalog LC', f"/student/{student_id}/read_current_LC_classes"),
+        ('order classes', f"/family/payments/view_order_classes/{order_id}"),
+        ('payments', "/family/payments"),
+        ('admin families', "/admin/read_families?limit=1000"),
+        ('admin students ndjson', "/admin/read_students?stream=true"),
+        ('admin rosters csv', f"/admin/rosters.csv?year={year}"),
+    ]
+
+
+def codecs():
+    found = [('gzip', lambda body: gzip.compress(body, compresslevel = GZIP_LEVEL))]
+    if brotli is not None:
+        found.append(('br', lambda body: brotli.compress(body, quality = BROTLI_QUALITY)))
+    return found
+
+
+def cpu_ms(compress, body: bytes):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.process_time()
+        compress(body)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+async def wire_bytes(client, url: str, headers: dict, encoding: str):
+    async with client.stream('GET', url, headers = {**headers, 'Accept-Encoding': encoding}) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        return response.status_code, response.headers.get('content-encoding', 'identity'), raw
+
+
+async def measure(students_by_family, year: int):
+    family_id = 1
+    transport = httpx.ASGITransport(app = app)
+    async with httpx.AsyncClient(transport = transport, base_url = 'http://bench') as client:
+        response = await client.post('/token', data = {'username': f"family{family_id}@e.com", 'password': '1234'})
+        headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+        rows = []
+        for name, url in endpoints(students_by_family[family_id][0], 1, year):
+            status, _, body = await wire_bytes(client, url, headers, 'identity')
+            row = {'endpoint': name, 'status': status, 'identity': len(body)}
+            for encoding, compress in codecs():
+                _, used, raw = await wire_bytes(client, url, headers, encoding)
+                row[encoding] = len(raw) if used == encoding else None
+                row[f"{encoding}_ms"] = cpu_ms(compress, body)
+            rows.append(row)
+        return rows
+
+
+def print_report(rows):
+    names = [encoding for encoding, _ in codecs()]
+    header = f"{'endpoint':24} {'identity':>10}"
+    for encoding in names:
+        header += f" {encoding:>10} {'ratio':>6} {encoding + ' ms':>8}"
+    print(header)
+    for row in rows:
+        line = f"{row['endpoint']:24} {row['identity']:10}"
+        for encoding in names:
+            size = row[encoding]
+            if size is None:        # under COMPRESS_MIN_SIZE, sent as is
+                line += f" {'-':>10} {'-':>6} {row[encoding + '_ms']:8.3f}"
+            else:
+                line += f" {size:10} {row['identity'] / size:6.1f} {row[encoding + '_ms']:8.3f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compressed response sizes and codec CPU per endpoint")
+    parser.add_argument('--families', type = int, default = 500)
+    parser.add_argument('--classes', type = int, default = 200)
+    parser.add_argument('--past-years', type = int, default = 3)
+    parser.add_argument('--database-url', default = 'sqlite:///bench/bench_compression.db',
+                        help = 'database to seed and run against, it is dropped and recreated')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    students_by_family = seed(args.database_url, args.families, args.classes, args.past_years, rng)
+    engine, async_engine = use_database(args.database_url, 5)
+    rows = asyncio.run(measure(students_by_family, datetime.now().year - 1))
+    print_report(rows)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
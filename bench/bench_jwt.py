@@ -0,0 +1,35 @@
+"""
+Filename: bench_jwt.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Micro-benchmark of token verification per request, full jwt.decode vs the cached path used by get_current_family.
+             Run from the project root: python -m bench.bench_jwt
+"""
+
+import os
+os.environ.setdefault('TESTING', '1')
+
+import timeit
+from datetime import timedelta
+from jose import jwt
+from app.routers.auth import create_access_token, decode_family_token, token_cache, SECRET_KEY, ALGORITHM
+
+REQUESTS = 20000
+
+
+def main():
+    token = create_access_token('bench@e.com', 1, timedelta(minutes=20))
+    token_cache.invalidate()
+
+    uncached = timeit.timeit(lambda: jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM]), number = REQUESTS)
+    decode_family_token(token)
+    cached = timeit.timeit(lambda: decode_family_token(token), number = REQUESTS)
+
+    print(f"jwt.decode           {uncached / REQUESTS * 1e6:8.2f} us/request")
+    print(f"decode_family_token  {cached / REQUESTS * 1e6:8.2f} us/request (cached)")
+    print(f"speedup              {uncached / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
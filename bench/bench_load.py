@@ -0,0 +1,282 @@
+"""
+Filename: bench_load.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Registration-opening-day load test. Seeds a database (SQLite by default) with families, students, classes
+             and past orders, then drives concurrent families through login, class browsing, class selection, checkout
+             and payment history in-process. Reports throughput and p50/p95/p99 latency per endpoint and saves the
+             results under bench/results so runs from different commits can be compared.
+             Run from the project root: python -m bench.bench_load --families 2000 --concurrency 50
+"""
+
+import os
+os.environ.setdefault('TESTING', '1')
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, to_async_url
+from app.main import app
+from app.models import Classes, CurrentClasses, Family, Student, StudentClass, Order, OrderStudentClass
+from app.routers.auth import get_db, get_async_db
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+LC_CATEGORIES = ['LC', 'CSL', 'AC', 'SP-FULL', 'SP-HALF', 'SP-EC', 'BOOK', 'SP-lang', 'SP-AC']
+EP_CATEGORIES = ['EP', 'EP-AM', 'SP-EP']
+BATCH = 5000
+
+
+def family_row(family_id: int, now: datetime):
+    return dict(
+        family_id = family_id, email = f"family{family_id}@e.com", password = "1234", o_family_id = "",
+        father_fname = "Father", father_lname = f"Test{family_id}", mother_fname = "Mother", mother_lname = f"Test{family_id}",
+        father_cname = "爸", mother_cname = "妈", address = "", address2 = "", city = "", state = "", zip = "",
+        country = "US", email2 = "", phone = "7777777777", phone2 = "", created = now, modified = now,
+        education = 0, income = 0, main_lang_id = "", verified = 0, activationCode = "000000", status = 0,
+        level = 0, help_id = 0, directory = 0, ecp_name = "", ecp_relation = "", ecp_phone = "", type = 0,
+        medical_cond = "", allergy = 0, doctor_name = "", doctor_phone = "", ins_company = "", ins_policy = "",
+        referral = " ",
+    )
+
+
+def student_row(student_id: int, family_id: int, now: datetime):
+    return dict(
+        student_id = student_id, o_student_id = "", family_id = family_id, first_name = "Student",
+        last_name = f"Test{family_id}", chinese_name = "同学", dob = f"01/{student_id % 28 + 1:02d}/2015",
+        gender = "M", grade = "0", created = now, modified = now, status = 1, email = "test@e.com",
+        medical_cond = "Example", allergy = "Example", doctor_name = "Example", doctor_phone = "Example",
+        ins_company = "Example", ins_policy = "Example",
+    )
+
+
+def insert_chunked(connection, model, rows):
+    for i in range(0, len(rows), BATCH):
+        connection.execute(insert(model), rows[i:i + BATCH])
+
+
+def seed(database_url: str, families: int, classes: int, past_years: int, rng: random.Random):
+    """Creates a fresh database and returns {family_id: [student_id, ...]}."""
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(bind = engine)
+    Base.metadata.create_all(bind = engine)
+
+    now = datetime.now()
+    year = now.year
+    categories = LC_CATEGORIES + EP_CATEGORIES
+
+    class_rows, current_rows = [], []
+    for class_id in range(1, classes + 1):
+        category = categories[class_id % len(categories)]
+        description = f"Description of class {class_id}. " * 20
+        class_rows.append(dict(class_id = class_id, class_code = str(class_id), category = category,
+                               title = f"Class {class_id}", description = description,
+                               chinese_title = "东西", chinese_description = "东西", age = 0,
+                               created = now, modified = now, seats_x = rng.randint(15, 30), weight = class_id))
+        current_rows.append(dict(year = year, class_id = class_id, category = category, weight = class_id,
+                                 title = f"Class {class_id}", description = description,
+                                 chinese_title = "东西", chinese_description = "东西"))
+
+    family_rows, student_rows, sc_rows, order_rows, osc_rows = [], [], [], [], []
+    students_by_family = {}
+    student_id = sc_id = order_id = 0
+    for family_id in range(1, families + 1):
+        family_rows.append(family_row(family_id, now))
+        owned = []
+        for _ in range(rng.randint(1, 3)):
+            student_id += 1
+            owned.append(student_id)
+            student_rows.append(student_row(student_id, family_id, now))
+        students_by_family[family_id] = owned
+
+        # paid history: one order per past year with a couple of classes per student
+        for past in range(1, past_years + 1):
+            order_id += 1
+            order_rows.append(dict(order_id = order_id, year = year - past, family_id = family_id, created = now,
+                                   paid = now, canceled = None, amount = 300, payment_method = "card",
+                                   transaction_id = str(order_id)))
+            for owned_id in owned:
+                for class_id in rng.sample(range(1, classes + 1), 2):
+                    sc_id += 1
+                    sc_rows.append(dict(sc_id = sc_id, year = year - past, student_id = owned_id, class_id = class_id,
+                                        wait = 0, paid = 1, paid_price = 150, created = now, removed = now))
+                    osc_rows.append(dict(order_id = order_id, sc_id = sc_id))
+
+    if engine.dialect.name == 'sqlite':
+        # readers should not block the single writer, closer to how MySQL behaves under load
+        with engine.connect() as connection:
+            connection.execute(text("PRAGMA journal_mode=WAL"))
+
+    with engine.begin() as connection:
+        for model, rows in ((Classes, class_rows), (CurrentClasses, current_rows), (Family, family_rows),
+                            (Student, student_rows), (StudentClass, sc_rows), (Order, order_rows),
+                            (OrderStudentClass, osc_rows)):
+            insert_chunked(connection, model, rows)
+    engine.dispose()
+    return students_by_family
+
+
+def use_database(database_url: str, pool_size: int):
+    connect_args = {"check_same_thread": False, "timeout": 30} if database_url.startswith('sqlite') else {}
+    engine = create_engine(database_url, connect_args = connect_args, pool_size = pool_size)
+    async_engine = create_async_engine(to_async_url(database_url), pool_size = pool_size,
+                                       connect_args = {"timeout": 30} if connect_args else {})
+    session_local = sessionmaker(autocommit = False, autoflush = False, bind = engine)
+    async_session_local = async_sessionmaker(async_engine, class_ = AsyncSession, autoflush = False,
+                                             expire_on_commit = False)
+
+    def bench_get_db():
+        db = session_local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def bench_get_async_db():
+        async with async_session_local() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = bench_get_db
+    app.dependency_overrides[get_async_db] = bench_get_async_db
+    return engine, async_engine
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def call(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def family_session(client, recorder, family_id, student_ids, classes, rng):
+    response = await recorder.call(client, 'POST /token', 'POST', '/token',
+                                   data = {'username': f"family{family_id}@e.com", 'password': '1234'})
+    headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+    for student_id in student_ids:
+        await recorder.call(client, 'GET read_current_LC_classes', 'GET',
+                            f"/student/{student_id}/read_current_LC_classes", headers = headers)
+        for class_id in rng.sample(range(1, classes + 1), 2):
+            await recorder.call(client, 'POST select_classes', 'POST', f"/student/{student_id}/select_classes",
+                                json = {'class_id': class_id}, headers = headers)
+
+    await recorder.call(client, 'GET /family/checkout', 'GET', '/family/checkout', headers = headers)
+    await recorder.call(client, 'GET /family/payments', 'GET', '/family/payments', headers = headers)
+
+
+async def run(students_by_family, concurrency: int, sessions: int, classes: int, rng: random.Random):
+    recorder = Recorder()
+    family_ids = rng.sample(sorted(students_by_family), min(sessions, len(students_by_family)))
+    queue = asyncio.Queue()
+    for family_id in family_ids:
+        queue.put_nowait(family_id)
+
+    transport = httpx.ASGITransport(app = app)
+    async with httpx.AsyncClient(transport = transport, base_url = 'http://bench') as client:
+        async def worker():
+            while not queue.empty():
+                family_id = queue.get_nowait()
+                await family_session(client, recorder, family_id, students_by_family[family_id], classes, rng)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for name, samples in sorted(recorder.samples.items()):
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(name, 0),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    return {'elapsed_seconds': round(elapsed, 3), 'requests': total,
+            'throughput_rps': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text = True,
+                                       stderr = subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(results, baseline = None):
+    print(f"{'endpoint':32} {'reqs':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results['endpoints'].items():
+        line = (f"{name:32} {row['requests']:7} {row['errors']:5} {row['throughput_rps']:9.1f} "
+                f"{row['p50_ms']:9.2f} {row['p95_ms']:9.2f} {row['p99_ms']:9.2f}")
+        before = (baseline or {}).get('endpoints', {}).get(name)
+        if before:
+            line += f"   p95 {row['p95_ms'] - before['p95_ms']:+.2f} ms vs {baseline['revision']}"
+        print(line)
+    print(f"total {results['requests']} requests in {results['elapsed_seconds']} s, {results['throughput_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('Description:')[1].split('Run from')[0].strip())
+    parser.add_argument('--families', type = int, default = 2000)
+    parser.add_argument('--classes', type = int, default = 40)
+    parser.add_argument('--past-years', type = int, default = 3)
+    parser.add_argument('--sessions', type = int, default = 300, help = 'families that log in during the run')
+    parser.add_argument('--concurrency', type = int, default = 50)
+    parser.add_argument('--database-url', default = 'sqlite:///bench/bench_load.db',
+                        help = 'database to seed and run against, it is dropped and recreated')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--compare', help = 'results file of an earlier run to compare against')
+    parser.add_argument('--no-save', action = 'store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    students_by_family = seed(args.database_url, args.families, args.classes, args.past_years, rng)
+    engine, async_engine = use_database(args.database_url, args.concurrency)
+
+    results = asyncio.run(run(students_by_family, args.concurrency, args.sessions, args.classes, rng))
+    results.update({
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec = 'seconds'),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('compare', 'no_save')},
+    })
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok = True)
+        path = RESULTS_DIR / f"{results['timestamp'].replace(':', '')}_{results['revision']}.json"
+        path.write_text(json.dumps(results, indent = 2))
+        print(f"saved {path}")
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Filename: test_admin.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for admin.py
+"""
+
+import csv
+import io
+import json
+from .utils import *
+from app.routers import auth
+from app.routers.auth import get_db, get_async_db, get_current_family
+from fastapi import status
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_current_family] = override_get_current_family
+
+
+@pytest.fixture(autouse=True)
+def admin_family(monkeypatch):
+    monkeypatch.setattr(auth, 'ADMIN_EMAILS', {'test1@e.com'})
+
+
+def test_admin_only(monkeypatch, test_family):
+    monkeypatch.setattr(auth, 'ADMIN_EMAILS', set())
+    for url in ("/admin/read_families", "/admin/read_students", "/admin/rosters.csv", "/admin/enrollment"):
+        assert client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+    app.dependency_overrides.pop(get_current_family)
+    try:
+        assert client.get("/admin/rosters.csv").status_code == status.HTTP_401_UNAUTHORIZED
+    finally:
+        app.dependency_overrides[get_current_family] = override_get_current_family
+
+
+def test_read_families_page(test_family):
+    response = client.get("/admin/read_families")
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["family_id"] for item in response.json()] == [1]
+
+    response = client.get("/admin/read_families?after_id=1")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+
+def test_read_students_stream(test_family, test_student):
+    response = client.get("/admin/read_students?stream=true")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 1
+    assert rows[0]["student_id"] == 1
+    assert rows[0]["first_name"] == "Student"
+
+
+def test_export_rosters(test_family, test_student, test_classes, test_student_class_unpaid):
+    response = client.get("/admin/rosters.csv?year=2026")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 1
+    assert rows[0]["class_id"] == "1"
+    assert rows[0]["first_name"] == "Student"
+    assert rows[0]["father_fname"] == "Father"
+
+
+def test_enrollment_counts(test_family, test_student, test_classes, test_student_class_unpaid):
+    response = client.get("/admin/enrollment?year=2026")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{"class_id": 1, "class_code": "1", "title": "Level 1", "seats": 1,
+                                "enrolled": 1, "waitlisted": 0, "paid": 0, "seats_left": 0}]
@@ -0,0 +1,92 @@
+"""
+Filename: test_auth.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for auth.py
+"""
+
+import asyncio
+import hashlib
+import pytest
+from datetime import timedelta
+from sqlalchemy import select
+from .utils import *
+from app.models import UserInfo
+from jose import JWTError
+from app.routers import auth
+from app.routers.auth import create_access_token, decode_family_token, token_cache, resolve_login
+
+
+def test_decode_family_token_cached(monkeypatch):
+    token_cache.invalidate()
+    token = create_access_token('test1@e.com', 1, timedelta(minutes=20))
+    assert decode_family_token(token) == {'email': 'test1@e.com', 'family_id': 1}
+
+    def fail_decode(*args, **kwargs):
+        raise AssertionError("token should come from the cache")
+
+    monkeypatch.setattr(auth.jwt, 'decode', fail_decode)
+    assert decode_family_token(token) == {'email': 'test1@e.com', 'family_id': 1}
+
+
+def test_decode_family_token_expired():
+    token_cache.invalidate()
+    token = create_access_token('test1@e.com', 1, timedelta(minutes=-1))
+    with pytest.raises(JWTError):
+        decode_family_token(token)
+    assert len(token_cache) == 0
+
+
+def test_decode_family_token_invalid():
+    token_cache.invalidate()
+    with pytest.raises(JWTError):
+        decode_family_token('not-a-token')
+
+
+def login(email, token = 'access'):
+    async def run():
+        async with AsyncTestingSessionLocal() as db:
+            await resolve_login(db, email, 'First', 'Last', {'access_token': token})
+    asyncio.run(run())
+
+
+def user_info_rows(email):
+    with engine.connect() as connection:
+        return connection.execute(select(UserInfo.email, UserInfo.profile_created).where(UserInfo.email == email)).all()
+
+
+@pytest.fixture
+def clean_user_info():
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM userinfo;"))
+        connection.commit()
+
+
+def test_resolve_login_is_one_statement(clean_user_info):
+    with record_statements() as statements:
+        login('new@e.com')
+        login('new@e.com')
+    assert len(statements) == 2
+    assert user_info_rows('new@e.com') == [('new@e.com', False)]
+
+
+def test_resolve_login_keeps_profile_of_family(test_family, clean_user_info):
+    with engine.connect() as connection:
+        connection.execute(text("INSERT INTO userinfo (email, profile_created, token_) VALUES "
+                                "('test1@e.com', 1, 't'), ('nofamily@e.com', 1, 't');"))
+        connection.commit()
+
+    login('test1@e.com')
+    login('nofamily@e.com')
+    assert user_info_rows('test1@e.com') == [('test1@e.com', True)]
+    assert user_info_rows('nofamily@e.com') == [('nofamily@e.com', False)]
+
+
+def test_resolve_login_stores_token_digest(clean_user_info):
+    token = 'ya29.' + 'x' * 250      # Google access tokens run past the 100 characters of userinfo.token_
+    login('long@e.com', token)
+    with engine.connect() as connection:
+        stored = connection.execute(select(UserInfo.token_).where(UserInfo.email == 'long@e.com')).scalar_one()
+    assert stored == hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,117 @@
+"""
+Filename: test_compression.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for compression.py
+"""
+
+import gzip
+import pytest
+from datetime import datetime
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from app.compression import CompressionMiddleware, choose_encoding
+from app.etags import not_modified, if_match_modified
+from app.main import app as main_app
+
+sample = FastAPI()
+sample.add_middleware(CompressionMiddleware, minimum_size = 500)
+
+
+@sample.get("/large")
+def large():
+    return [{"description": "Description " * 10} for _ in range(50)]
+
+
+@sample.get("/small")
+def small():
+    return {"status": "ok"}
+
+
+@sample.get("/tagged")
+def tagged(request: Request):
+    if not_modified(request, '"v1"'):
+        return Response(status_code = 304, headers = {"ETag": '"v1"'})
+    return Response("tagged " * 200, media_type = "text/plain", headers = {"ETag": '"v1"'})
+
+
+@sample.get("/stream")
+def stream():
+    return StreamingResponse((f"line {i}\n" * 50 for i in range(20)), media_type = "text/plain")
+
+
+client = TestClient(sample)
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br", ('br', 'gzip')) == 'br'
+    assert choose_encoding("gzip, deflate, br", ('gzip',)) == 'gzip'
+    assert choose_encoding("br;q=0.5, gzip;q=0.8", ('br', 'gzip')) == 'gzip'
+    assert choose_encoding("gzip;q=0, *;q=0.1", ('gzip',)) is None
+    assert choose_encoding("*", ('br', 'gzip')) == 'br'
+    assert choose_encoding("", ('br', 'gzip')) is None
+    assert choose_encoding("identity", ('br', 'gzip')) is None
+
+
+def test_large_response_gzipped():
+    response = client.get("/large", headers = {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()[0]["description"].startswith("Description")
+
+
+def test_small_response_not_compressed():
+    response = client.get("/small", headers = {"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"status": "ok"}
+
+
+def test_identity_when_not_accepted():
+    response = client.get("/large", headers = {"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_stream_gzipped():
+    with client.stream("GET", "/stream", headers = {"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(raw).decode().count("line 19") == 50
+
+
+def test_large_response_brotli():
+    pytest.importorskip("brotli")
+    response = client.get("/large", headers = {"Accept-Encoding": "br, gzip"})
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_main_app_compresses():
+    response = TestClient(main_app).get("/openapi.json", headers = {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+
+
+def test_compressed_etag_has_coding_suffix():
+    response = client.get("/tagged", headers = {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == '"v1-gzip"'
+
+    response = client.get("/tagged", headers = {"Accept-Encoding": "identity"})
+    assert response.headers["etag"] == '"v1"'
+
+    response = client.get("/tagged", headers = {"Accept-Encoding": "gzip", "If-None-Match": '"v1-gzip"'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"v1-gzip"'
+
+
+def test_not_modified_ignores_coding_suffix():
+    request = Request({'type': 'http', 'headers': [(b'if-none-match', b'W/"v1-br", "v2-gzip"')]})
+    assert not_modified(request, '"v1"')
+    assert not_modified(request, '"v2"')
+    assert not not_modified(request, '"v3"')
+
+
+def test_if_match_ignores_coding_suffix():
+    request = Request({'type': 'http', 'headers': [(b'if-match', b'"7-20250116120000000000-gzip"')]})
+    assert if_match_modified(request, 7) == datetime(2025, 1, 16, 12, 0, 0)
@@ -0,0 +1,100 @@
+"""
+Filename: test_discovery.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for discovery.py, against a local stand-in for the provider
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app import discovery
+from app.routers.auth import OAUTH_PROVIDERS, get_oauth_client
+
+JWKS = {'keys': [{'kty': 'oct', 'kid': 'test', 'k': 'c2VjcmV0'}]}
+
+
+class Provider(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        documents = {
+            '/.well-known/openid-configuration': {
+                'issuer': base,
+                'authorization_endpoint': base + '/authorize',
+                'token_endpoint': base + '/token',
+                'jwks_uri': base + '/jwks',
+            },
+            '/jwks': JWKS,
+        }
+        Provider.hits.append(self.path)
+        if self.path not in documents:
+            self.send_error(404)
+            return
+        body = json.dumps(documents[self.path]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def provider():
+    Provider.hits = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Provider)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/.well-known/openid-configuration"
+    server.shutdown()
+    server.server_close()
+
+
+def test_metadata_is_fetched_once(provider, tmp_path):
+    first = asyncio.run(discovery.load_server_metadata(provider, cache_dir = str(tmp_path)))
+    assert first['jwks'] == JWKS
+    assert '_loaded_at' in first
+    assert Provider.hits == ['/.well-known/openid-configuration', '/jwks']
+
+    # another worker reading the same directory
+    second = asyncio.run(discovery.load_server_metadata(provider, cache_dir = str(tmp_path)))
+    assert second == first
+    assert len(Provider.hits) == 2
+
+
+def test_expired_metadata_is_refetched(provider, tmp_path):
+    asyncio.run(discovery.load_server_metadata(provider, cache_dir = str(tmp_path)))
+    asyncio.run(discovery.load_server_metadata(provider, ttl = 0, cache_dir = str(tmp_path)))
+    assert len(Provider.hits) == 4
+
+
+def test_stale_metadata_served_when_provider_is_down(tmp_path):
+    url = 'http://127.0.0.1:9/.well-known/openid-configuration'
+    discovery.write_entry(discovery.cache_path(url, str(tmp_path)), {'url': url, 'fetched': 0, 'document': {'issuer': 'x'}})
+    metadata = asyncio.run(discovery.load_server_metadata(url, cache_dir = str(tmp_path)))
+    assert metadata == {'issuer': 'x', '_loaded_at': 0}
+
+
+def test_oauth_client_uses_cached_metadata(provider, tmp_path, monkeypatch):
+    monkeypatch.setattr(discovery, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(OAUTH_PROVIDERS, 'local', dict(
+        server_metadata_url = provider,
+        client_id = 'id',
+        client_secret = 'secret',
+        client_kwargs = {'scope': 'openid email profile'},
+    ))
+    client = asyncio.run(get_oauth_client('local'))
+    assert client.server_metadata['jwks'] == JWKS
+    assert client.server_metadata['token_endpoint'].endswith('/token')
+
+    # authlib sees the metadata as loaded and does not fetch it again
+    asyncio.run(client.load_server_metadata())
+    asyncio.run(client.fetch_jwk_set())
+    assert len(Provider.hits) == 2
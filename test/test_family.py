@@ -7,10 +7,11 @@ Description: Unit tests for family.py
 """
 
 from .utils import *
-from app.routers.auth import get_db, get_current_family
+from app.routers.auth import get_db, get_async_db, get_current_family
 from fastapi import status
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_current_family] = override_get_current_family
 
 
@@ -61,6 +62,7 @@ def test_return_volunteer(test_family, test_voluneer_activity, test_volunteer_ac
 
 
 def test_update_family(test_family):
+    assert client.get("/family/profile/view").json()['city'] != "Some City"      # caches the family context
     response = client.put(
         "/family/profile/edit",
         json={
@@ -94,3 +96,105 @@ def test_update_family(test_family):
             "ins_policy": ""
         })
     assert response.status_code == status.HTTP_200_OK
+    assert client.get("/family/profile/view").json()['city'] == "Some City"
+
+
+def record_updates(request):
+    with record_statements('UPDATE') as statements:
+        response = request()
+    return response, [statement for statement, _ in statements]
+
+
+def test_patch_family(test_family):
+    response, updates = record_updates(lambda: client.patch("/family/profile/edit", json={"city": "Some City", "phone": "7777777777"}))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"updated": ["city"]}
+    assert len(updates) == 1
+    assert "city" in updates[0] and "modified" in updates[0]
+    assert "phone" not in updates[0] and "father_fname" not in updates[0]
+    assert client.get("/family/profile/view").json()['city'] == "Some City"
+
+
+def test_patch_family_no_change(test_family):
+    response, updates = record_updates(lambda: client.patch("/family/profile/edit", json={"phone": "7777777777", "city": None}))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"updated": []}
+    assert updates == []
+
+
+def test_return_family_not_modified(test_family):
+    response = client.get("/family/profile/view")
+    etag = response.headers['ETag']
+    response = client.get("/family/profile/view", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+
+def test_update_family_if_match(test_family):
+    etag = client.get("/family/profile/view").headers['ETag']
+    body = client.get("/family/profile/view").json()
+    body['city'] = "Some City"
+
+    response = client.put("/family/profile/edit", json=body, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    assert client.get("/family/profile/view", headers={'If-None-Match': new_etag}).status_code == status.HTTP_304_NOT_MODIFIED
+
+    # second edit from the version loaded before the first one
+    response = client.put("/family/profile/edit", json=body, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    response = client.patch("/family/profile/edit", json={"city": "Other City"}, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    response = client.patch("/family/profile/edit", json={"city": "Other City"}, headers={'If-Match': new_etag})
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_update_family_if_match_same_second(test_family):
+    response = client.get("/family/profile/view")
+    etag = response.headers['ETag']
+    body = response.json()
+    body['city'] = "Some City"
+
+    # two writers load the version the first edit produced, both send their edit within the same second
+    first = client.put("/family/profile/edit", json=body, headers={'If-Match': etag})
+    assert first.status_code == status.HTTP_200_OK
+    body['city'] = "Other City"
+    response = client.put("/family/profile/edit", json=body, headers={'If-Match': first.headers['ETag']})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != first.headers['ETag']
+    body['city'] = "Third City"
+    response = client.put("/family/profile/edit", json=body, headers={'If-Match': first.headers['ETag']})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert client.get("/family/profile/view").json()['city'] == "Other City"
+
+
+def test_patch_family_if_match_concurrent_edit(test_family):
+    etag = client.get("/family/profile/view").headers['ETag']
+
+    # another request commits after the PATCH read the row, before its UPDATE
+    with commit_before('UPDATE', "UPDATE families SET city = 'Their City', modified = '2030-01-01 00:00:00';"):
+        response = client.patch("/family/profile/edit", json={"city": "Other City"}, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    family_contexts.invalidate()
+    assert client.get("/family/profile/view").json()['city'] == "Their City"
+
+
+def test_profile_edited_on_another_worker(test_family, test_student):
+    etag = client.get("/family/profile/view").headers['ETag']
+    student_etag = client.get("/family/student/1").headers['ETag']
+
+    # saved through another worker, this worker's family context is not dropped
+    with engine.connect() as connection:
+        connection.execute(text("UPDATE families SET city = 'Their City', modified = '2030-01-01 00:00:00';"))
+        connection.execute(text("UPDATE students SET allergy = 'Theirs', modified = '2030-01-01 00:00:00';"))
+        connection.commit()
+
+    response = client.get("/family/profile/view", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['city'] == "Their City"
+    response = client.get("/family/student/1", headers={'If-None-Match': student_etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['allergy'] == "Theirs"
+    assert client.get("/family/student").json()[0]['allergy'] == "Theirs"
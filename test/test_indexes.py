@@ -0,0 +1,89 @@
+"""
+Filename: test_indexes.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Query-plan tests, every query issued by the hot router paths must use an index instead of a table scan
+"""
+
+from .utils import *
+from app.routers.auth import get_db, get_async_db, get_current_family
+from app.migrate import missing_indexes, create_missing_indexes
+from app.routers.register import invalidate_catalog
+from app.seats import seat_counter
+from fastapi import status
+from sqlalchemy import create_engine, inspect
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_current_family] = override_get_current_family
+
+# current_classes only holds one term's catalog and is read through the catalog cache
+ALLOWED_SCANS = {'current_classes'}
+
+
+def router_selects(requests):
+    with record_statements('SELECT') as statements:
+        for method, url, body in requests:
+            response = client.request(method, url, json=body)
+            assert response.status_code < 400, (url, response.text)
+    return statements
+
+
+def table_scans(statements):
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, tuple(parameters)).all()
+            for row in plan:
+                detail = row[-1]
+                if detail.startswith('SCAN') and 'USING' not in detail:
+                    table = detail.split()[1]
+                    if table not in ALLOWED_SCANS:
+                        scans.append((detail, statement))
+    return scans
+
+
+def test_models_have_no_missing_indexes():
+    assert missing_indexes(engine) == []
+
+
+def test_migrate_makes_user_info_email_unique():
+    legacy = create_engine("sqlite://")
+    Base.metadata.create_all(bind = legacy)
+    with legacy.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_userinfo_email")
+        connection.exec_driver_sql("CREATE INDEX ix_userinfo_email ON userinfo (email)")
+        connection.exec_driver_sql("INSERT INTO userinfo (id, email, profile_created, token_) VALUES "
+                                   "(1, 'a@e.com', 0, 't'), (2, 'a@e.com', 1, 't'), (3, 'b@e.com', 0, 't')")
+
+    created, removed = create_missing_indexes(legacy)
+    assert 'ix_userinfo_email' in created
+    assert removed == 1
+    assert missing_indexes(legacy) == []
+    index = next(ix for ix in inspect(legacy).get_indexes('userinfo') if ix['name'] == 'ix_userinfo_email')
+    assert index['unique']
+    with legacy.connect() as connection:
+        # the oldest row is kept and takes profile_created from its duplicate
+        assert connection.exec_driver_sql("SELECT id, profile_created FROM userinfo ORDER BY id").all() == [(1, 1), (3, 0)]
+
+
+def test_router_queries_use_indexes(test_family, test_student, test_classes, test_current_classes_1, test_student_class_paid,
+                                    test_order_paid, test_order_student_class, test_voluneer_activity,
+                                    test_volunteer_activity_year, test_family_year):
+    invalidate_catalog()
+    seat_counter.invalidate()
+    statements = router_selects([
+        ('GET', '/family/profile/view', None),
+        ('GET', '/family/profile/volunteer', None),
+        ('GET', '/family/student', None),
+        ('GET', '/family/student/1/registration_history', None),
+        ('GET', '/student/1/read_current_LC_classes', None),
+        ('POST', '/student/1/select_classes', {'class_id': 1}),
+        ('GET', '/family/checkout', None),
+        ('GET', '/family/payments', None),
+        ('GET', f'/family/payments/view_order_details/{test_order_paid.order_id}', None),
+        ('GET', f'/family/payments/view_order_classes/{test_order_paid.order_id}', None),
+    ])
+    assert statements
+    assert table_scans(statements) == []
@@ -6,9 +6,14 @@ Version: 1.0
 Description: Unit tests for main.py
 """
 
+import os
+import subprocess
+import sys
+from pathlib import Path
 from fastapi.testclient import TestClient
 from app.main import app
 from fastapi import status
+from app.metrics import metrics
 
 client = TestClient(app)
 
@@ -16,3 +21,55 @@ def test_return_health_check():
     response = client.get("/healthy")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'status': 'Healthy'}
+
+def test_return_pool_stats():
+    response = client.get("/healthy/pool")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    for key in ('size', 'checked_in', 'checked_out', 'overflow', 'checkouts', 'wait_seconds_total', 'wait_seconds_max'):
+        assert key in data
+
+
+def test_return_metrics():
+    metrics.reset()
+    client.get("/healthy")
+    client.get("/healthy")
+    response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    route = response.json()['routes']['GET /healthy']
+    assert route['count'] == 2
+    assert route['errors'] == 0
+    assert sum(route['latency_buckets'].values()) == 2
+
+
+# seconds app.main may take to import on a cold interpreter, raise it on slow CI machines
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET', '3'))
+
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import app.main
+print(time.perf_counter() - start)
+print('authlib' in sys.modules)
+"""
+
+def test_startup_is_lazy():
+    env = {k: v for k, v in os.environ.items() if k not in ('yahoo-id', 'yahoo-secret', 'CREATE_SCHEMA')}
+    env['TESTING'] = '1'
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd = Path(__file__).resolve().parents[1],
+                            env = env, capture_output = True, text = True, timeout = 60)
+    assert result.returncode == 0, result.stderr
+    seconds, authlib_loaded = result.stdout.split()[-2:]
+    assert authlib_loaded == 'False'
+    assert float(seconds) < STARTUP_BUDGET
+
+
+def test_unconfigured_oauth_provider():
+    from app.routers.auth import OAUTH_PROVIDERS
+    saved = OAUTH_PROVIDERS['yahoo']
+    OAUTH_PROVIDERS['yahoo'] = {**saved, 'client_id': None}
+    try:
+        response = client.get("/login/yahoo", follow_redirects = False)
+    finally:
+        OAUTH_PROVIDERS['yahoo'] = saved
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
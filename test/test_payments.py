@@ -7,14 +7,20 @@ Description: Unit tests for payments.py
 """
 
 from .utils import *
-from app.routers.auth import get_db, get_current_family
+from app.routers.auth import get_db, get_async_db, get_current_family
 from fastapi import status
+from app.metrics import metrics, instrument_engine
+from app.cart import rebuild_carts
+from app.seats import seat_counter
+from app.history import summarize_past_orders
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_current_family] = override_get_current_family
 
 
 def test_view_cart(test_family, test_student, test_student_class_unpaid, test_classes):
+    rebuild_carts(engine, 2026)
     response = client.get("/family/checkout")
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
@@ -72,3 +78,99 @@ def test_view_order_classes_not_found(test_family):
     assert data[0].get("name") == "Total"
     assert data[0].get("Price") == 0
 
+
+def count_order_classes_queries(order_id, volunteer_lines):
+    db = TestingSessionLocal()
+    for i in range(volunteer_lines):
+        sc = StudentClass(year = 2026, student_id = 0, class_id = 1, wait = False, paid = True,
+                          paid_price = 5, created = now, removed = now)
+        db.add(sc)
+        db.flush()
+        db.add(OrderStudentClass(order_id = order_id, sc_id = sc.sc_id))
+    db.commit()
+    db.close()
+
+    with record_statements() as statements:
+        response = client.get(f"/family/payments/view_order_classes/{order_id}")
+
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM order_student_class;"))
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.commit()
+
+    assert response.status_code == 200
+    volunteer_rows = [item for item in response.json() if item.get("name") == "Family"]
+    assert len(volunteer_rows) == volunteer_lines
+    assert all(item["title"] == "Some Activity" for item in volunteer_rows)
+    return len(statements)
+
+
+def test_view_order_classes_constant_queries(test_family, test_order_paid, test_voluneer_activity, test_volunteer_activity_year):
+    one_line = count_order_classes_queries(test_order_paid.order_id, 1)
+    many_lines = count_order_classes_queries(test_order_paid.order_id, 20)
+    assert one_line == many_lines
+    assert many_lines <= 2
+
+
+def test_view_payments_query_metrics(test_family, test_order_paid, test_order_student_class):
+    instrument_engine(async_engine.sync_engine)
+    metrics.reset()
+    response = client.get("/family/payments")
+    assert response.status_code == status.HTTP_200_OK
+    route = metrics.snapshot()['GET /family/payments']
+    assert route['count'] == 1
+    assert route['db_queries_total'] == 1
+
+
+def test_view_cart_after_select_classes(test_family, test_student, test_classes):
+    seat_counter.invalidate()
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.execute(text("DELETE FROM family_cart;"))
+        connection.commit()
+
+    response = client.post("/student/1/select_classes", json={'class_id': 1})
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.get("/family/checkout")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["student_id"] == 1
+    assert data[0]["title"] == "Level 1"
+    assert data[0]["first_name"] == "Student"
+
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.execute(text("DELETE FROM family_cart;"))
+        connection.commit()
+
+
+def test_view_payments_past_years_summarized(test_family, test_order_paid):
+    db = TestingSessionLocal()
+    past_order = Order(year = 2020, family_id = 1, created = now, paid = now, canceled = None, amount = 2.50,
+                       payment_method = "card", transaction_id = "2020")
+    db.add(past_order)
+    db.commit()
+    db.add_all([OrderStudentClass(order_id = past_order.order_id, sc_id = 1),
+                OrderStudentClass(order_id = past_order.order_id, sc_id = 2)])
+    db.commit()
+
+    assert summarize_past_orders(engine, 2026) == 1
+    assert summarize_past_orders(engine, 2026) == 0
+
+    # summarized rows are served as stored
+    db.execute(text("DELETE FROM order_student_class;"))
+    db.commit()
+
+    response = client.get("/family/payments")
+    assert response.status_code == status.HTTP_200_OK
+    data = {item["order_id"]: item for item in response.json()}
+    assert set(data) == {test_order_paid.order_id, past_order.order_id}
+    assert data[past_order.order_id]["number_of_classes"] == 2
+    assert data[past_order.order_id]["amount"] == 2.5
+    assert data[test_order_paid.order_id]["number_of_classes"] == 0
+
+    db.execute(text("DELETE FROM order_summary;"))
+    db.commit()
+    db.close()
@@ -7,10 +7,17 @@ Description: Unit tests for register.py
 """
 
 from .utils import *
-from app.routers.auth import get_db, get_current_family
+from app.routers.auth import get_db, get_async_db, get_current_family
+from app.seats import seat_counter
+from app.routers.register import invalidate_catalog
+from app.versions import bump_version, CATALOG
 from fastapi import status
+from app.sessions import family_contexts
+import asyncio
+import httpx
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_current_family] = override_get_current_family
 
 
@@ -22,11 +29,96 @@ def test_read_current_LC_classes_fail(test_family, test_student, test_student_cl
     response = client.get("/student/99/read_current_LC_classes")
     assert response.status_code == 404
 
+def test_read_current_LC_classes_profile_completed_elsewhere(test_family, test_student, test_current_classes_1):
+    # the cached copy predates the doctor being filled in through another worker, the fresh row is verified
+    assert client.get("/family/student/1").status_code == status.HTTP_200_OK
+    key = family_contexts.key(1)
+    cached = family_contexts.store.get(key)
+    stale = [{**student, 'doctor_name': ''} for student in cached['students']]
+    family_contexts.store.set(key, {**cached, 'students': stale}, family_contexts.ttl)
+
+    response = client.get("/student/1/read_current_LC_classes")
+    assert response.status_code == status.HTTP_200_OK
+
+def test_read_current_LC_classes_incomplete_profile(test_family, test_student, test_current_classes_1):
+    db = TestingSessionLocal()
+    db.query(Student).filter(Student.student_id == 1).update({'doctor_name': ''})
+    db.commit()
+    db.close()
+    response = client.get("/student/1/read_current_LC_classes")
+    assert response.status_code == status.HTTP_409_CONFLICT
+
 def test_read_current_EP_classes(test_family, test_student, test_student_class_unpaid, test_current_classes_2):
     response = client.get("/student/1/read_current_EP_classes")
     assert response.status_code == status.HTTP_200_OK
 
-def test_select_classes(test_family, test_student):
+def test_read_current_LC_classes_cached(test_family, test_student, test_student_class_unpaid, test_current_classes_1):
+    invalidate_catalog()
+    response = client.get("/student/1/read_current_LC_classes")
+    assert response.json()[0]['class_id'] == 1
+    assert response.json()[0]['class_selected'] == 1
+
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM current_classes;"))
+        connection.commit()
+
+    response = client.get("/student/1/read_current_LC_classes")
+    assert len(response.json()) == 1
+
+    invalidate_catalog()
+    response = client.get("/student/1/read_current_LC_classes")
+    assert response.json() == []
+
+def test_read_current_LC_classes_one_catalog_lookup(test_family, test_student, test_student_class_unpaid, test_current_classes_1):
+    invalidate_catalog()
+    client.get("/student/1/read_current_LC_classes")
+    with record_statements('SELECT') as statements:
+        response = client.get("/student/1/read_current_LC_classes")
+    assert response.status_code == status.HTTP_200_OK
+    # version and classes come from the same cache entry, its version row is read once
+    assert len([statement for statement, _ in statements if 'cache_version' in statement]) == 1
+    assert not [statement for statement, _ in statements if 'FROM current_classes' in statement]
+    # the selection version and class_selected come from one grouped query
+    assert len([statement for statement, _ in statements if 'FROM student_class' in statement]) == 1
+
+def test_read_current_LC_classes_version_bumped(test_family, test_student, test_student_class_unpaid, test_current_classes_1):
+    invalidate_catalog()
+    assert len(client.get("/student/1/read_current_LC_classes").json()) == 1
+
+    # another process rewrites the catalog and bumps its version, this worker's cached copy is dropped
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM current_classes;"))
+        bump_version(connection, CATALOG)
+
+    assert client.get("/student/1/read_current_LC_classes").json() == []
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM cache_version;"))
+
+def test_read_current_LC_classes_not_modified(test_family, test_student, test_student_class_unpaid, test_current_classes_1):
+    invalidate_catalog()
+    response = client.get("/student/1/read_current_LC_classes")
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'max-age=0, must-revalidate'
+
+    response = client.get("/student/1/read_current_LC_classes", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+    # other category list, other resource
+    response = client.get("/student/1/read_current_EP_classes", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+
+    # a new selection changes the version
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.commit()
+    response = client.get("/student/1/read_current_LC_classes", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]['class_selected'] == 0
+
+def test_select_classes(test_family, test_student, test_classes):
+    seat_counter.invalidate()
     request_data={
         'class_id': '1'
     }
@@ -38,3 +130,123 @@ def test_select_classes(test_family, test_student):
     model = db.query(StudentClass).filter(StudentClass.student_id == 1, StudentClass.class_id == int(request_data.get('class_id'))).first()
     assert model.student_id == 1
     assert model.class_id == int(request_data.get('class_id'))
+    assert model.wait == False
+
+
+def test_select_classes_waitlist(test_family, test_student, test_classes):
+    seat_counter.invalidate()
+    db = TestingSessionLocal()
+    db.execute(text("DELETE FROM student_class;"))
+    db.add(StudentClass(year = datetime.now().year, student_id = 2, class_id = 1, wait = False,
+                        paid = False, paid_price = 0, created = now, removed = now))
+    db.commit()
+
+    response = client.post("/student/1/select_classes", json={'class_id': 1})
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['wait'] == True
+
+    model = db.query(StudentClass).filter(StudentClass.student_id == 1, StudentClass.class_id == 1).first()
+    assert model.wait == True
+    db.execute(text("DELETE FROM student_class;"))
+    db.commit()
+
+
+
+def test_select_classes_concurrent(test_family, test_student, test_classes):
+    # five clicks at once on a one-seat class, only one of them may get the seat
+    seat_counter.invalidate()
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.commit()
+
+    async def run():
+        transport = httpx.ASGITransport(app = app)
+        async with httpx.AsyncClient(transport = transport, base_url = 'http://test') as async_client:
+            return await asyncio.gather(*[
+                async_client.post("/student/1/select_classes", json={'class_id': 1}) for _ in range(5)
+            ])
+
+    responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [status.HTTP_201_CREATED] * 5
+    assert sorted(response.json()['wait'] for response in responses) == [False, True, True, True, True]
+
+    db = TestingSessionLocal()
+    assert db.query(StudentClass).filter(StudentClass.class_id == 1, StudentClass.wait == 0).count() == 1
+    assert db.query(StudentClass).filter(StudentClass.class_id == 1, StudentClass.wait == 1).count() == 4
+    db.execute(text("DELETE FROM student_class;"))
+    db.commit()
+
+
+
+def test_select_classes_seat_counter(test_family, test_student, test_classes):
+    seat_counter.invalidate()
+    db = TestingSessionLocal()
+    db.execute(text("UPDATE classes SET seats_x = 5;"))
+    db.commit()
+
+    client.post("/student/1/select_classes", json={'class_id': 1})
+    with record_statements() as statements:
+        response = client.post("/student/1/select_classes", json={'class_id': 1})
+    assert response.json()['wait'] == False
+
+    # the counter row is open, the seat is one UPDATE committed on its own and nothing counts student_class
+    sql = [statement for statement, _ in statements]
+    assert not [statement for statement in sql if 'count(' in statement]
+    seat = [i for i, statement in enumerate(sql) if statement.startswith('UPDATE class_seats')]
+    assert len(seat) == 1
+    assert not [statement for statement in sql[:seat[0]] if 'student_class' in statement and 'INSERT' in statement]
+    assert db.execute(text("SELECT taken FROM class_seats WHERE class_id = 1;")).scalar() == 2
+    db.execute(text("DELETE FROM student_class;"))
+    db.commit()
+
+def test_select_classes_not_found(test_family, test_student):
+    seat_counter.invalidate()
+    response = client.post("/student/1/select_classes", json={'class_id': 99})
+    assert response.status_code == 404
+
+
+def test_select_classes_bulk(test_family, test_student, test_classes):
+    seat_counter.invalidate()
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM student_class;"))
+        connection.commit()
+
+    request_data = {'selections': [{'student_id': 1, 'class_id': 1}, {'student_id': 1, 'class_id': 1}]}
+    response = client.post("/student/select_classes", json=request_data)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {'registered': [{'student_id': 1, 'class_id': 1, 'wait': False}], 'skipped': []}
+
+    response = client.post("/student/select_classes", json=request_data)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {'registered': [], 'skipped': [{'student_id': 1, 'class_id': 1}]}
+
+    db = TestingSessionLocal()
+    assert db.query(StudentClass).filter(StudentClass.student_id == 1).count() == 1
+    db.execute(text("DELETE FROM student_class;"))
+    db.commit()
+
+
+
+def test_select_classes_bulk_one_insert(test_family, test_student, test_classes):
+    seat_counter.invalidate()
+    db = TestingSessionLocal()
+    db.add(Classes(class_id = 2, class_code = "2", category = "LC", title = "Level 2", description = "", chinese_title = "",
+                   chinese_description = "", age = 0, created = now, modified = now, seats_x = 0, weight = 2))
+    db.commit()
+
+    request_data = {'selections': [{'student_id': 1, 'class_id': 1}, {'student_id': 1, 'class_id': 2}]}
+    with record_statements() as statements:
+        response = client.post("/student/select_classes", json=request_data)
+    assert response.json()['registered'] == [{'student_id': 1, 'class_id': 1, 'wait': False},
+                                             {'student_id': 1, 'class_id': 2, 'wait': True}]
+
+    sql = [statement for statement, _ in statements]
+    assert len([statement for statement in sql if statement.startswith('UPDATE class_seats')]) == 2
+    assert len([statement for statement in sql if statement.startswith('INSERT INTO student_class')]) == 1
+    db.execute(text("DELETE FROM student_class;"))
+    db.commit()
+
+def test_select_classes_bulk_not_in_family(test_family, test_student, test_classes):
+    request_data = {'selections': [{'student_id': 1, 'class_id': 1}, {'student_id': 99, 'class_id': 1}]}
+    response = client.post("/student/select_classes", json=request_data)
+    assert response.status_code == 404
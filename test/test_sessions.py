@@ -0,0 +1,83 @@
+"""
+Filename: test_sessions.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for sessions.py
+"""
+
+import asyncio
+from .utils import *
+from app.sessions import FamilyContexts, MemoryStore, SessionStore
+from app.routers.auth import get_db, get_async_db, get_current_family
+from fastapi import status
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_current_family] = override_get_current_family
+
+
+def load(contexts, family_id):
+    async def run():
+        async with AsyncTestingSessionLocal() as db:
+            return await contexts.load(db, family_id)
+    return asyncio.run(run())
+
+
+def count_queries(function):
+    with record_statements() as statements:
+        result = function()
+    return result, len(statements)
+
+
+def test_family_context_is_cached(test_family, test_student):
+    contexts = FamilyContexts(MemoryStore())
+    context, queries = count_queries(lambda: load(contexts, 1))
+    assert queries == 2
+    assert context.family['email'] == 'test1@e.com'
+    assert context.owns(1)
+    assert not context.owns(2)
+    assert context.student(1)['first_name'] == 'Student'
+
+    context, queries = count_queries(lambda: load(contexts, 1))
+    assert queries == 0
+    assert list(context.student_ids) == [1]
+
+
+def test_family_context_invalidate(test_family, test_student):
+    contexts = FamilyContexts(MemoryStore())
+    load(contexts, 1)
+    contexts.invalidate(1)
+    _, queries = count_queries(lambda: load(contexts, 1))
+    assert queries == 2
+
+
+def test_family_context_missing_family():
+    contexts = FamilyContexts(MemoryStore())
+    assert load(contexts, 1) is None
+
+
+
+
+def test_student_added_by_another_worker(test_family, test_student):
+    # this worker cached the family before the student was added elsewhere, the student is looked up instead of a 401
+    assert client.get("/family/student/1").status_code == status.HTTP_200_OK
+    key = family_contexts.key(1)
+    family_contexts.store.set(key, {**family_contexts.store.get(key), 'students': []}, family_contexts.ttl)
+
+    response = client.get("/family/student/1")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['first_name'] == 'Student'
+    assert client.get("/family/student/2").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+    class PartialStore(SessionStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
@@ -7,11 +7,12 @@ Description: Unit tests for student.py
 """
 
 from .utils import *
-from app.routers.auth import get_db, get_current_family
+from app.routers.auth import get_db, get_async_db, get_current_family
 from fastapi import status
 from datetime import date
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_current_family] = override_get_current_family
 
 now = datetime.now()
@@ -46,8 +47,10 @@ def test_create_child(test_family, test_student):
         "ins_policy": "Example"
     } 
                     
+    assert len(client.get("/family/student").json()) == 1      # caches the family context
     response = client.post("/family/student/add", json=request_data)
     assert response.status_code == 201
+    assert len(client.get("/family/student").json()) == 2
 
     db = TestingSessionLocal()
     try:
@@ -89,6 +92,16 @@ def test_update_student_family_profile(test_family, test_student):
         db.close()
 
 
+def test_update_student_not_in_family(test_family, test_student):
+    response = client.put("/family/student/99", json={
+        "first_name": "Student", "last_name": "Test", "chinese_name": "", "dob": "01/01/2000", "gender": "M",
+        "grade": "0", "email": "", "medical_cond": "", "allergy": "", "doctor_name": "", "doctor_phone": "",
+        "ins_company": "", "ins_policy": ""
+    })
+    assert response.status_code == 401
+    assert client.get("/family/student/99/registration_history").status_code == 401
+
+
 def test_view_student_history(test_family, test_student, test_classes, test_student_class_paid):
     response = client.get("/family/student/1/registration_history")
     assert response.status_code == status.HTTP_200_OK
@@ -100,3 +113,84 @@ def test_view_student_history(test_family, test_student, test_classes, test_stud
     assert row["class_code"] == "1" 
     assert row["title"] == "Level 1"
     assert row["chinese_title"] == "东西" 
+
+
+def test_patch_student(test_family, test_student):
+    with record_statements('UPDATE') as updates:
+        response = client.patch("/family/student/1", json={"allergy": "Peanut", "first_name": "Student"})
+        assert response.json() == {"updated": ["allergy"]}
+        response = client.patch("/family/student/1", json={"allergy": "Peanut"})
+        assert response.json() == {"updated": []}
+
+    assert len(updates) == 1
+    statement, _ = updates[0]
+    assert "allergy" in statement and "first_name" not in statement
+    assert client.get("/family/student").json()[0]["allergy"] == "Peanut"
+
+
+def test_get_students_not_modified(test_family, test_student):
+    etag = client.get("/family/student").headers['ETag']
+    response = client.get("/family/student", headers={'If-None-Match': 'W/' + etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    client.patch("/family/student/1", json={"allergy": "Peanut"})
+    response = client.get("/family/student", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != etag
+
+
+def test_update_student_if_match(test_family, test_student):
+    response = client.get("/family/student/1")
+    etag = response.headers['ETag']
+    body = {name: response.json()[name] for name in ("first_name", "last_name", "chinese_name", "dob", "gender", "grade",
+            "email", "medical_cond", "allergy", "doctor_name", "doctor_phone", "ins_company", "ins_policy")}
+    body['allergy'] = "Peanut"
+
+    response = client.put("/family/student/1", json=body, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert client.get("/family/student/1").headers['ETag'] == response.headers['ETag']
+
+    response = client.put("/family/student/1", json=body, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    response = client.put("/family/student/1", json=body, headers={'If-Match': '"garbage"'})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+
+
+def test_student_if_match_same_second(test_family, test_student):
+    etag = client.get("/family/student/1").headers['ETag']
+
+    # edits stamped within one second still get a new ETag each, a writer holding the previous one gets 412
+    first = client.patch("/family/student/1", json={"allergy": "Peanut"}, headers={'If-Match': etag})
+    second = client.patch("/family/student/1", json={"allergy": "Milk"}, headers={'If-Match': first.headers['ETag']})
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    assert second.headers['ETag'] != first.headers['ETag']
+    response = client.patch("/family/student/1", json={"allergy": "Egg"}, headers={'If-Match': first.headers['ETag']})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+
+def test_patch_student_if_match_concurrent_edit(test_family, test_student):
+    etag = client.get("/family/student/1").headers['ETag']
+
+    # another request commits after the PATCH read the row, before its UPDATE
+    with commit_before('UPDATE', "UPDATE students SET allergy = 'Theirs', modified = '2030-01-01 00:00:00';"):
+        response = client.patch("/family/student/1", json={"allergy": "Peanut"}, headers={'If-Match': etag})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    family_contexts.invalidate()
+    assert client.get("/family/student/1").json()['allergy'] == "Theirs"
+
+def test_view_student_history_not_modified(test_family, test_student, test_classes, test_student_class_paid):
+    response = client.get("/family/student/1/registration_history")
+    etag = response.headers['ETag']
+
+    with record_statements() as statements:
+        response = client.get("/family/student/1/registration_history", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert len(statements) == 1        # version key only, the history query does not run
+
+    with engine.connect() as connection:
+        connection.execute(text("UPDATE classes SET modified = '2030-01-01 00:00:00';"))
+        connection.commit()
+    response = client.get("/family/student/1/registration_history", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != etag
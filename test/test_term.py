@@ -0,0 +1,62 @@
+"""
+Filename: test_term.py
+Author: Meghan Dang
+Date: 2025-01-16
+Version: 1.0
+Description: Unit tests for term.py
+"""
+
+from .utils import *
+from app.models import StudentClassArchive, BatchProgress, CacheVersion
+from app.term import close_term, archive_student_classes
+
+
+def clear_term_tables():
+    with engine.connect() as connection:
+        for table in ("student_class", "student_class_archive", "batch_progress", "current_classes",
+                      "family_year", "order_summary", "family_cart", "cache_version"):
+            connection.execute(text(f"DELETE FROM {table};"))
+        connection.commit()
+
+
+def test_close_term(test_family, test_classes, test_student, test_student_class_unpaid, test_family_year,
+                    test_order_paid, test_order_student_class):
+    db = TestingSessionLocal()
+    db.add(StudentClass(year = 2026, student_id = 1, class_id = 1, wait = True, paid = False, paid_price = 0,
+                        created = now, removed = now))
+    db.commit()
+
+    results = close_term(engine, 2026, 2027, chunk_size = 1)
+    assert results['mark_paid'] == 1
+    assert results['current_classes'] == 1
+    assert results['family_year'] == 1
+
+    # the class in the paid order is kept and marked paid, the waitlisted one is archived and removed
+    remaining = db.query(StudentClass).all()
+    assert [(row.sc_id, row.paid) for row in remaining] == [(1, True)]
+    assert db.query(StudentClassArchive).count() == 2
+
+    current = db.query(CurrentClasses).all()
+    assert [(row.year, row.class_id, row.title) for row in current] == [(2027, 1, "Level 1")]
+    assert db.query(CacheVersion).filter(CacheVersion.name == "catalog").first().version == 1
+    assert db.query(FamilyYear).filter(FamilyYear.year == 2027, FamilyYear.family_id == 1).first().paid == False
+    assert db.query(BatchProgress).filter(BatchProgress.done == True).count() == 3
+
+    # finished jobs are not run again
+    assert close_term(engine, 2026, 2027, chunk_size = 1)['mark_paid'] == 0
+    db.close()
+    clear_term_tables()
+
+
+def test_archive_resumes_after_checkpoint(test_student_class_unpaid):
+    db = TestingSessionLocal()
+    db.add(BatchProgress(job = "close_term:2026:archive", last_key = test_student_class_unpaid.sc_id, done = False))
+    db.add(StudentClass(year = 2026, student_id = 1, class_id = 2, wait = False, paid = False, paid_price = 0,
+                        created = now, removed = now))
+    db.commit()
+
+    # the first row is behind the checkpoint, only the second is archived (1 insert + 1 delete)
+    assert archive_student_classes(engine, 2026, chunk_size = 1) == 2
+    assert [row.class_id for row in db.query(StudentClassArchive).all()] == [2]
+    db.close()
+    clear_term_tables()
@@ -6,17 +6,22 @@ Version: 1.0
 Description: Utilities for unit testing. Overriding functions and creating testing models
 """
 
-from sqlalchemy import create_engine, text
-from sqlalchemy.pool import StaticPool
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool, NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.database import Base
 from app.main import app
 from fastapi.testclient import TestClient
 from datetime import datetime
+from contextlib import contextmanager
 import pytest
+from app.sessions import family_contexts
 from app.models import Classes, CurrentClasses, Family, FamilyYear, Student, StudentClass, Order, OrderStudentClass, VolunteerActivities, VolunteerActivityYear
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# file database so the sync fixtures and the async routers see the same tables
+SQLALCHEMY_DATABASE_URL = "sqlite:///./testing.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./testing.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
@@ -24,8 +29,13 @@ engine = create_engine(
     poolclass = StaticPool,
 )
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass = NullPool)
+
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, class_ = AsyncSession, autoflush = False,
+                                              expire_on_commit = False)
 
+Base.metadata.drop_all(bind=engine)
 Base.metadata.create_all(bind=engine)
 
 
@@ -36,6 +46,10 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
 def override_get_current_family():
     return {'email': 'test1@e.com', 'family_id': 1}
 
@@ -43,6 +57,47 @@ client = TestClient(app)
 now = datetime.utcnow()
 
 
+# (statement, parameters) of every statement the routers send while the block runs, kind keeps one statement
+# type only, e.g. 'SELECT' or 'UPDATE'
+@contextmanager
+def record_statements(kind = None):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if kind is None or statement.lstrip().upper().startswith(kind):
+            statements.append((statement, parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+# commits sql right before the routers' first statement of kind, like an edit another request makes between
+# the route's read and its write
+@contextmanager
+def commit_before(kind, sql):
+    pending = [sql]
+    def interleave(conn, cursor, statement, parameters, context, executemany):
+        if pending and statement.lstrip().upper().startswith(kind):
+            with engine.connect() as connection:
+                connection.execute(text(pending.pop()))
+                connection.commit()
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", interleave)
+    try:
+        yield
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", interleave)
+
+
+# fixtures write straight to the database, start every test without cached family contexts
+@pytest.fixture(autouse=True)
+def clear_family_contexts():
+    family_contexts.invalidate()
+    yield
+
+
 @pytest.fixture
 def test_classes():
     test_class = Classes(
@@ -66,6 +121,7 @@ def test_classes():
     yield test_class
     with engine.connect() as connection:
         connection.execute(text("DELETE FROM classes;"))
+        connection.execute(text("DELETE FROM class_seats;"))
         connection.commit()
 
 